@@ -35,7 +35,10 @@ Notes:
  - sometimes some stats info is available for a match, but not all of the 
    stats were recorded - we put in 0's for the missing ones
 
- - suspicious looking stats go into the final 'Suspect Columns' column
+ - suspicious looking stats go into the final 'Suspect Columns' column. As
+   well as a few logical checks, we learn the quantiles of every stat (and
+   the duration) per surface and year as we load, and flag values outside
+   SUSPECT_QUANTILES of theirs. See StatQuantiles
 
  - we calculate player ages, but date-of-birth info isn't available for all
    players; we exclude matches they're involved in. this costs us less than
@@ -43,14 +46,31 @@ Notes:
 
 '''
 
+import array
+import bisect
+import cPickle
+import math
+import os
+import random
+import struct
+import sys
+import unicodedata
+
 PLAYERS_FILE = "players_%s.csv"
 TOURS_FILE   = "tours_%s.csv"
 GAMES_FILE   = "games_%s.csv"
 STATS_FILE   = "stat_%s.csv"
+SNAPSHOT_EXT = ".snap"  # binary snapshots live next to the csv they came from
 
 ROUNDS_FILE  = "rounds.csv"
 COURTS_FILE  = "courts.csv"
 
+# stats outside these quantiles of their surface and year are suspect, as
+# long as we've seen at least MIN_QUANTILE_COUNT values to learn them from
+SUSPECT_QUANTILES  = (0.001, 0.999)
+MIN_QUANTILE_COUNT = 200
+SKETCH_K = 600 # QuantileSketch size: ~0.1% rank error, ~3*SKETCH_K values held
+
 DEBUG = True
 
 class BadHeaderError(Exception): pass
@@ -68,6 +88,16 @@ def convertOnCourtDateToYmd(dateStr):
                     dateParts[0],
                     dateParts[1])
 
+def ymdToOrdinal(ymdStr):
+    '''
+    ymdStr looks like YYYY/MM/DD (see convertOnCourtDateToYmd), note that
+    months and days aren't necessarily zero-padded so these don't sort as
+    strings. We return the proleptic Gregorian ordinal (1 == 0001/01/01)
+    '''
+    from datetime import date
+    y, m, d = ymdStr.split("/")
+    return date(int(y), int(m), int(d)).toordinal()
+
 class MatchKey(object):
     '''
     Key to uniquely identify a match in the raw CSV files
@@ -108,6 +138,291 @@ class MatchKey(object):
         return self._name
 
 
+def rawKeyOf(rawRow):
+    '''
+    Returns the 4-part key (winnerID, loserID, tourID, roundID) at the start
+    of a raw games_/stat_ csv-string as a tuple of strings. Much cheaper than
+    splitting the whole row or building a MatchKey, so it's what we use for
+    set-work over entire files
+    '''
+    return tuple(rawRow.replace('"','').split(",", 4)[:4])
+
+
+class MatchKeyReconciler(object):
+    '''
+    Works out up front which rows of games_<gender>.csv and stat_<gender>.csv
+    can't be joined cleanly, using hashed sets of raw keys (see rawKeyOf):
+     - duplicate games keys: only the first row for such a key is loaded
+     - duplicate stats keys: likewise, only the first row is loaded
+     - orphan stats keys: stats rows with no games row, never loaded at all
+     - games keys without stats: perfectly normal (we write 'n/a' for them)
+       but worth counting
+    Call reconcile() with the raw keys of both files, then use the is*()
+    methods while joining and writeReport() to leave a record of it all
+    '''
+    def __init__(self):
+        self._gamesKeys = set()
+        self._statsKeys = set()
+        self._dupGamesKeys = dict()   # raw key -> number of rows seen
+        self._dupStatsKeys = dict()   # raw key -> number of rows seen
+        self._orphanStatsKeys = set()
+        self._gamesRows, self._statsRows = 0, 0
+        self._gamesWithoutStats = 0
+
+    def reconcile(self, gamesKeys, statsKeys):
+        '''
+        gamesKeys, statsKeys are iterables of the raw keys (see rawKeyOf) of
+        every row of the raw files, in file order
+        Returns: nothing
+        '''
+        rowCounts = list()
+        for rawKeys, keys, dups in ((gamesKeys, self._gamesKeys,
+                                                self._dupGamesKeys),
+                                    (statsKeys, self._statsKeys,
+                                                self._dupStatsKeys)):
+            nRows = 0
+            for rawKey in rawKeys:
+                nRows += 1
+                if rawKey in keys:
+                    dups[rawKey] = dups.get(rawKey, 1) + 1
+                else:
+                    keys.add(rawKey)
+            rowCounts.append(nRows)
+
+        self._gamesRows, self._statsRows = rowCounts
+        self._orphanStatsKeys = self._statsKeys - self._gamesKeys
+        self._gamesWithoutStats = len(self._gamesKeys - self._statsKeys)
+        if DEBUG: print "MatchKeyReconciler: %s" % self.summary()
+
+    def isDuplicateGame(self, rawKey):
+        return rawKey in self._dupGamesKeys
+
+    def isDuplicateStats(self, rawKey):
+        return rawKey in self._dupStatsKeys
+
+    def isOrphanStats(self, rawKey):
+        return rawKey in self._orphanStatsKeys
+
+    def summary(self):
+        return ("gamesRows=%s statsRows=%s duplicateGamesKeys=%s "
+                "duplicateStatsKeys=%s orphanStatsKeys=%s "
+                "gamesKeysWithoutStats=%s" % (
+                    self._gamesRows, self._statsRows,
+                    len(self._dupGamesKeys), len(self._dupStatsKeys),
+                    len(self._orphanStatsKeys), self._gamesWithoutStats))
+
+    def writeReport(self, destPath):
+        '''
+        Writes the summary line, then one section per kind of problem key.
+        Games keys without stats are only counted - there are far too many of
+        them to be worth listing
+        '''
+        with open(destPath, "w") as f:
+            f.write("%s\n" % self.summary())
+            for title, keys in (("duplicateGamesKeys", self._dupGamesKeys),
+                                ("duplicateStatsKeys", self._dupStatsKeys),
+                                ("orphanStatsKeys", self._orphanStatsKeys)):
+                f.write("[%s]\n" % title)
+                for rawKey in sorted(keys):
+                    if isinstance(keys, dict):
+                        f.write("%s %s\n" % ("/".join(rawKey), keys[rawKey]))
+                    else:
+                        f.write("%s\n" % "/".join(rawKey))
+
+
+class RawCsvTable(object):
+    '''
+    A raw games_/stat_ csv file held in memory as lines, minus the header.
+    Rows are only split into their elements when asked for, so callers can
+    look at rawKey(i) first and skip rows they're not interested in.
+    RawTableSnapshot offers exactly the same interface
+    '''
+    def __init__(self, fname):
+        self._fname = fname
+        with open(fname, "r") as f:
+            f.readline() # skips the header
+            self._rows = f.readlines()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def rawKey(self, i):
+        return rawKeyOf(self._rows[i])
+
+    def rawKeys(self):
+        for row in self._rows:
+            yield rawKeyOf(row)
+
+    def elements(self, i):
+        return self._rows[i].replace('"','').strip().split(",")
+
+
+class RawTableSnapshot(object):
+    '''
+    Typed binary copy of a raw games_/stat_ csv file, so repeat runs don't
+    have to re-parse hundreds of MB of text. A row is laid out as:
+     - 4 key columns (winner/loser/tour/round IDs): int32, stored by column
+     - nIntCols integer columns (the stats): int16, stored row-major since
+       we always want all of them for a row at once
+     - nStrCols string columns (result, dates, ...): each one stored as
+       uint32 offsets (nRows+1 of them) into a bytes arena
+    Elements come back positioned exactly as in the csv, i.e. keys, then
+    ints, then strings, so this only suits tables laid out that way.
+
+    The file is a fixed-size header followed by each section in the order
+    above, every section starting on a 4-byte boundary, so it can also be
+    memory-mapped (e.g. with numpy.memmap) by other tools.
+    The header records the size and mtime of the csv we were built from,
+    see isFreshFor()
+    '''
+    MAGIC = "OCSNAP01"
+    # magic, byteorder, csv size, csv mtime, nRows, nIntCols, nStrCols
+    HEADER = struct.Struct("<8scxxxQdIII")
+    KEY_COLS = 4
+
+    def __init__(self, srcSize, srcMtime, keyCols, ints, nIntCols, strCols):
+        self._srcSize = srcSize
+        self._srcMtime = srcMtime
+        self._keyCols = keyCols    # list<array('i')>, one per key column
+        self._ints = ints          # array('h'), nRows * nIntCols of them
+        self._nIntCols = nIntCols
+        self._strCols = strCols    # list<(array('I') offsets, str arena)>
+
+    def __len__(self):
+        return len(self._keyCols[0])
+
+    def rawKey(self, i):
+        return tuple(str(c[i]) if c[i] else "" for c in self._keyCols)
+
+    def rawKeys(self):
+        for ids in zip(*self._keyCols):
+            yield tuple(str(_id) if _id else "" for _id in ids)
+
+    def elements(self, i):
+        elements = list(self.rawKey(i))
+        n = self._nIntCols
+        elements.extend(self._ints[i*n:(i+1)*n].tolist())
+        for offsets, arena in self._strCols:
+            elements.append(arena[offsets[i]:offsets[i+1]])
+        return elements
+
+    def isFreshFor(self, csvPath):
+        '''
+        True if csvPath looks like the file we were ingested from
+        '''
+        st = os.stat(csvPath)
+        return st.st_size == self._srcSize and st.st_mtime == self._srcMtime
+
+    @classmethod
+    def ingest(cls, csvPath, nIntCols, nStrCols):
+        '''
+        Parses csvPath exactly as RawCsvTable would and converts it.
+        Raises: ValueError if a key or int column isn't an integer
+                OverflowError if an int column doesn't fit in an int16
+        '''
+        st = os.stat(csvPath)
+        table = RawCsvTable(csvPath)
+        keyCols = [array.array("i") for x in xrange(cls.KEY_COLS)]
+        ints = array.array("h")
+        strCols = [(array.array("I", [0]), list()) for x in xrange(nStrCols)]
+        strLens = [0] * nStrCols
+        firstStrCol = cls.KEY_COLS + nIntCols
+        for i in xrange(len(table)):
+            elements = table.elements(i)
+            if len(elements) < firstStrCol + nStrCols:
+                raise ValueError("Row %s of %s has only %s columns" % (
+                                               i, csvPath, len(elements)))
+            for c in xrange(cls.KEY_COLS):
+                keyCols[c].append(int(elements[c]) if elements[c] else 0)
+            ints.extend([int(x) if x.strip() else 0
+                         for x in elements[cls.KEY_COLS:firstStrCol]])
+            for c in xrange(nStrCols):
+                value = elements[firstStrCol + c]
+                strLens[c] += len(value)
+                strCols[c][0].append(strLens[c])
+                strCols[c][1].append(value)
+
+        strCols = [(offsets, "".join(values)) for offsets, values in strCols]
+        return cls(st.st_size, st.st_mtime, keyCols, ints, nIntCols, strCols)
+
+    def write(self, snapPath):
+        if DEBUG: print "RawTableSnapshot: Writing %s" % snapPath
+        def pad(f):
+            f.write("\0" * (-f.tell() % 4))
+
+        with open(snapPath, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, sys.byteorder[0],
+                                     self._srcSize, self._srcMtime, len(self),
+                                     self._nIntCols, len(self._strCols)))
+            for col in self._keyCols:
+                col.tofile(f)
+            self._ints.tofile(f)
+            pad(f)
+            for offsets, arena in self._strCols:
+                offsets.tofile(f)
+                f.write(arena)
+                pad(f)
+
+    @classmethod
+    def read(cls, snapPath):
+        '''
+        Raises: ValueError if snapPath isn't a snapshot we understand
+        '''
+        if DEBUG: print "RawTableSnapshot: Reading %s" % snapPath
+        def fromfile(f, typecode, n):
+            a = array.array(typecode)
+            a.fromfile(f, n)
+            if byteorder != sys.byteorder[0]:
+                a.byteswap()
+            return a
+        def skipPad(f):
+            f.seek(-f.tell() % 4, os.SEEK_CUR)
+
+        with open(snapPath, "rb") as f:
+            (magic, byteorder, srcSize, srcMtime, nRows, nIntCols,
+                    nStrCols) = cls.HEADER.unpack(f.read(cls.HEADER.size))
+            if magic != cls.MAGIC:
+                raise ValueError("%s is not a snapshot" % snapPath)
+            keyCols = [fromfile(f, "i", nRows) for x in xrange(cls.KEY_COLS)]
+            ints = fromfile(f, "h", nRows * nIntCols)
+            skipPad(f)
+            strCols = list()
+            for x in xrange(nStrCols):
+                offsets = fromfile(f, "I", nRows + 1)
+                strCols.append((offsets, f.read(offsets[-1])))
+                skipPad(f)
+        return cls(srcSize, srcMtime, keyCols, ints, nIntCols, strCols)
+
+
+def openRawTable(csvPath, nIntCols, nStrCols, useSnapshot):
+    '''
+    Returns a RawCsvTable for csvPath, or if useSnapshot is set, a
+    RawTableSnapshot of it: read from csvPath's .snap file if that's fresh,
+    otherwise (re)built from csvPath and saved for the next run. We fall back
+    to the csv if it can't be snapshotted
+    '''
+    if not useSnapshot:
+        return RawCsvTable(csvPath)
+
+    snapPath = "%s%s" % (os.path.splitext(csvPath)[0], SNAPSHOT_EXT)
+    if os.path.exists(snapPath):
+        try:
+            snapshot = RawTableSnapshot.read(snapPath)
+            if snapshot.isFreshFor(csvPath):
+                return snapshot
+            print "INFO: Snapshot %s is stale, rebuilding" % snapPath
+        except (ValueError, EOFError, struct.error) as e:
+            print "WARNING: Unreadable snapshot %s, rebuilding: %s" % (
+                                                               snapPath, e)
+    try:
+        snapshot = RawTableSnapshot.ingest(csvPath, nIntCols, nStrCols)
+    except (ValueError, OverflowError) as e:
+        print "WARNING: Can't snapshot %s, using the csv: %s" % (csvPath, e)
+        return RawCsvTable(csvPath)
+    snapshot.write(snapPath)
+    return snapshot
+
+
 class IDToNameMapper(object):
     '''
     This ADT is the base-class for a bunch of CSV file-readers which seek to
@@ -128,6 +443,15 @@ class IDToNameMapper(object):
         
     def getName(self, id):
         return self._map[id]
+
+    def getIDs(self, names):
+        '''
+        Reverse lookup: returns the set of IDs mapping to any of names
+        (compared case-insensitively)
+        '''
+        names = set(name.lower() for name in names)
+        return set(_id for _id, name in self._map.iteritems()
+                   if name.lower() in names)
     
     def load(self):
         '''
@@ -175,6 +499,190 @@ class IDToNameMapper(object):
         if DEBUG: print "Mapper: Loaded %s entries from %s" % (
                                         len(self._map), fname)
 
+# letters NFKD doesn't decompose into a plain letter plus accents
+FOLDED_LETTERS = {u"\xf8": u"o", u"\xd8": u"o", u"\xdf": u"ss", u"\u0111": u"d",
+                  u"\u0110": u"d", u"\u0142": u"l", u"\u0141": u"l",
+                  u"\xe6": u"ae", u"\xc6": u"ae", u"\u0153": u"oe",
+                  u"\u0152": u"oe", u"\u0131": u"i", u"\xf0": u"d",
+                  u"\xfe": u"th"}
+
+
+def foldName(name):
+    '''
+    Returns name lower-cased, in plain ascii (accents dropped) with anything
+    but letters and digits turned into single spaces, e.g.
+    "Juan-Mart\xedn del Potro" -> "juan martin del potro"
+    '''
+    if isinstance(name, str):
+        try:
+            name = name.decode("utf-8")
+        except UnicodeDecodeError:
+            name = name.decode("cp1252", "replace") # OnCourt's a windows app
+    name = unicodedata.normalize("NFKD", name)
+    name = u"".join(FOLDED_LETTERS.get(c, c) for c in name
+                    if not unicodedata.combining(c))
+    name = u"".join(c if c.isalnum() else u" " for c in name.lower())
+    return " ".join(name.encode("ascii", "ignore").split())
+
+
+def nameForms(foldedName):
+    '''
+    Returns the set of forms we index a (folded) name under: the name itself
+    and, for every place its surname might start, the surname and the
+    surname followed by the first names
+    '''
+    tokens = foldedName.split()
+    forms = set([foldedName])
+    for i in xrange(1, len(tokens)):
+        forms.add(" ".join(tokens[i:]))
+        forms.add(" ".join(tokens[i:] + tokens[:i]))
+    return forms
+
+
+def initialForms(foldedName):
+    '''
+    Returns the set of "surname initial(s)" forms of a (folded) name, for
+    every place its surname might start, the way other sources write names
+    (e.g. "del potro j", "del potro j m")
+    '''
+    tokens = foldedName.split()
+    forms = set()
+    for i in xrange(1, len(tokens)):
+        forms.add(" ".join(tokens[i:] + [tokens[0][0]]))
+        forms.add(" ".join(tokens[i:] + [n[0] for n in tokens[:i]]))
+    return forms
+
+
+def trigrams(form):
+    padded = " %s " % form
+    return set(padded[i:i + 3] for i in xrange(len(padded) - 2))
+
+
+class PlayerNameIndex(object):
+    '''
+    Search index over player names, for tools that start from a typed name:
+     - autocomplete(): players with a name form starting with a prefix. The
+       forms are kept sorted, so a prefix is a bisect to the start of a
+       contiguous range (what a prefix trie gives you, in two flat lists)
+     - search(): fuzzy lookup, scoring forms by the Dice coefficient of
+       their trigrams with the query's. Trigrams map to the forms they're in
+       (an inverted index); a form scoring at least minScore must share a
+       minimum number of trigrams with the query, so only forms that do get
+       scored. Initials forms are left out of the trigram index: they share
+       most of their trigrams with the surname and first names forms, and
+       the single letters would make for huge postings
+    Queries go through foldName() like the names do
+    '''
+    MIN_SCORE = 0.5
+
+    def __init__(self):
+        self._forms = list()    # sorted list<name form>
+        self._owners = list()   # same order: tuple of IDs with that form
+        self._gramCounts = array.array("B") # same order: trigrams per form
+        self._postings = dict() # trigram -> array of positions in _forms
+
+    def build(self, idsAndNames):
+        '''
+        idsAndNames is an iterable of (ID, name)
+        '''
+        owners = dict() # form -> list<ID>
+        searchable = set()
+        for _id, name in idsAndNames:
+            folded = foldName(name)
+            if not folded:
+                continue
+            for form in nameForms(folded):
+                owners.setdefault(form, list()).append(_id)
+                searchable.add(form)
+            for form in initialForms(folded):
+                owners.setdefault(form, list()).append(_id)
+        self._forms = sorted(owners)
+        self._owners = [tuple(owners[form]) for form in self._forms]
+        self._postings = dict()
+        self._gramCounts = array.array("B")
+        for position, form in enumerate(self._forms):
+            grams = trigrams(form) if form in searchable else ()
+            self._gramCounts.append(min(len(grams), 255))
+            for gram in grams:
+                if gram not in self._postings:
+                    self._postings[gram] = array.array("i")
+                self._postings[gram].append(position)
+
+    def __len__(self):
+        return len(self._forms)
+
+    def autocomplete(self, prefix, limit=10):
+        '''
+        Returns list<ID> (at most limit, no repeats) of the players with a
+        name form starting with prefix, in order of those forms
+        '''
+        prefix = foldName(prefix)
+        result, seen = list(), set()
+        position = bisect.bisect_left(self._forms, prefix)
+        while (position < len(self._forms) and len(result) < limit and
+               self._forms[position].startswith(prefix)):
+            for _id in self._owners[position]:
+                if _id not in seen:
+                    seen.add(_id)
+                    result.append(_id)
+            position += 1
+        return result[:limit]
+
+    def search(self, query, limit=10, minScore=MIN_SCORE):
+        '''
+        Returns list<(ID, score)> of the (at most limit) players whose best
+        name form is most like query, best first. Scores go from minScore
+        to 1 (for the same trigrams)
+        '''
+        queryGrams = trigrams(foldName(query))
+        if not queryGrams:
+            return []
+        # a form with c trigrams in common scores 2c / (|query| + |form|),
+        # and c <= |form|, so scoring minScore needs c >= minCommon
+        minCommon = max(1, int(math.ceil(minScore * len(queryGrams) /
+                                         (2.0 - minScore))))
+        # and a form with that many must have at least one of the query's
+        # rarest len(queryGrams) - minCommon + 1 trigrams: only the forms in
+        # those postings are candidates, the others' postings just count
+        byRarity = sorted(queryGrams,
+                          key=lambda gram: len(self._postings.get(gram, ())))
+        rarest = len(byRarity) - minCommon + 1
+        # atLeast[k] is the candidates with more than k of the query's
+        # trigrams among the postings seen so far. Set operations keep the
+        # counting out of python loops
+        atLeast = [set() for k in xrange(minCommon)]
+        allHits = list() # per trigram, the candidates with it
+        for n, gram in enumerate(byRarity):
+            postings = self._postings.get(gram, ())
+            hits = (set(postings) if n < rarest else
+                    atLeast[0].intersection(postings))
+            for k in xrange(minCommon - 1, 0, -1):
+                atLeast[k] |= atLeast[k - 1] & hits
+            atLeast[0] |= hits
+            allHits.append(hits)
+
+        best = dict() # ID -> best score
+        for position in atLeast[-1]:
+            common = sum(1 for hits in allHits if position in hits)
+            score = 2.0 * common / (len(queryGrams) +
+                                    self._gramCounts[position])
+            if score >= minScore:
+                for _id in self._owners[position]:
+                    if score > best.get(_id, 0.0):
+                        best[_id] = score
+        return sorted(best.iteritems(),
+                      key=lambda (_id, score): (-score, _id))[:limit]
+
+    def getState(self):
+        '''
+        Returns the index as plain python objects, for pickling
+        '''
+        return (self._forms, self._owners, self._gramCounts, self._postings)
+
+    def setState(self, state):
+        self._forms, self._owners, self._gramCounts, self._postings = state
+
+
 class PlayerInfo(object):
     def __init__(self, _id, name, dob):
         ''' all fields public, life's too short '''
@@ -215,6 +723,7 @@ class PlayerMapper(IDToNameMapper):
                                            
         self._dobMapper = PlayerDOBMapper(gender, wd, idColumn, dobColumn)
         self._id2playerinfo = dict()
+        self._nameIndex = PlayerNameIndex()
 
     def load(self):
         '''
@@ -222,6 +731,7 @@ class PlayerMapper(IDToNameMapper):
          - load via our base-class call - this loads ID to NAME info
          - get our dobMapper to do the same - this loads ID to DOB info
          - create + store a PlayerInfo object populated with the fetched data
+         - build the name search index, see PlayerNameIndex
         '''
         super(PlayerMapper, self).load()
         self._dobMapper.load()
@@ -235,6 +745,11 @@ class PlayerMapper(IDToNameMapper):
             dob = self._dobMapper._map[playerid]
             pi = PlayerInfo(playerid, name, dob)
             self._id2playerinfo[playerid] = pi
+        # doubles pairs aren't players, so leave them out of the search
+        self._nameIndex.build((playerid, name) for playerid, name in
+                              self._map.iteritems() if "/" not in name)
+        if DEBUG: print "PlayerMapper: Indexed %s name forms" % (
+                                                        len(self._nameIndex))
 
     def getPlayerInfo(self, _id):
         if _id in self._id2playerinfo:
@@ -242,6 +757,43 @@ class PlayerMapper(IDToNameMapper):
         else:
             return None
 
+    def autocomplete(self, prefix, limit=10):
+        '''
+        Returns list<player ID> of players with a name starting with prefix,
+        see PlayerNameIndex
+        '''
+        return self._nameIndex.autocomplete(prefix, limit)
+
+    def search(self, query, limit=10):
+        '''
+        Returns list<(player ID, score)> of players with names like query,
+        see PlayerNameIndex
+        '''
+        return self._nameIndex.search(query, limit)
+
+    def save(self, destPath):
+        '''
+        Saves what load() loaded and built, so that restore() can skip it
+        '''
+        with open(destPath, "wb") as f:
+            cPickle.dump((self._map, self._dobMapper._map,
+                          self._nameIndex.getState()), f, 2)
+
+    def restore(self, srcPath):
+        '''
+        Instead of load(), reads back what save() saved
+        '''
+        with open(srcPath, "rb") as f:
+            self._map, self._dobMapper._map, indexState = cPickle.load(f)
+        self._nameIndex.setState(indexState)
+        self._id2playerinfo = dict()
+        for playerid, name in self._map.iteritems():
+            if "/" not in name and playerid in self._dobMapper._map:
+                self._id2playerinfo[playerid] = PlayerInfo(
+                        playerid, name, self._dobMapper._map[playerid])
+        if DEBUG: print "PlayerMapper: Restored %s players from %s" % (
+                                                    len(self._map), srcPath)
+
 
 
 
@@ -263,14 +815,36 @@ class TourMapper(IDToNameMapper):
         return self._toursMap[_id]
         
     
+    def getTourIDs(self, years=None, surfaces=None):
+        '''
+        Returns the set of IDs of tours which started in one of years (ints)
+        and were played on one of surfaces (court names, which our
+        CourtMapper turns into court IDs). None means any year/surface
+        '''
+        surfaceIDs = None
+        if surfaces is not None:
+            surfaceIDs = self._courtMapper.getIDs(surfaces)
+        tourIDs = set()
+        for _id, tour in self._toursMap.iteritems():
+            if surfaceIDs is not None and tour.surfaceID not in surfaceIDs:
+                continue
+            if years is not None:
+                if not tour.date:
+                    continue
+                if int(convertOnCourtDateToYmd(tour.date)[0:4]) not in years:
+                    continue
+            tourIDs.add(_id)
+        return tourIDs
+    
     class TourInfo(object):
-        def __init__(self, _id, name, surface, date, country):
+        def __init__(self, _id, name, surface, date, country, surfaceID):
             # all members public
             self._id = _id
             self.name = name
             self.surface = surface
             self.date = date
             self.country = country
+            self.surfaceID = surfaceID # raw court ID, surface is its name
 
     def load(self):
         # this will be a list<str> of the file minus the header
@@ -327,7 +901,8 @@ class TourMapper(IDToNameMapper):
             if pID and pName:
                 self._map[pID] = pName # let this throw on dupes
             
-            tour = TourMapper.TourInfo(pID, pName, surface, date, country)
+            tour = TourMapper.TourInfo(pID, pName, surface, date, country,
+                                       elements[surfacePosition])
             self._toursMap[pID] = tour
                         
         
@@ -356,6 +931,60 @@ class CourtMapper(IDToNameMapper):
                                           idColumn,
                                           nameColumn)
 
+class MatchFilter(object):
+    '''
+    Restricts the matches AugmentedGamesfileGenerator.load() bothers with.
+    Every criterion is optional (None lets anything through) and a match has
+    to pass all of them:
+     - years: years (ints) the match's tournament started in
+     - surfaces: court names, e.g. ["Hard"]
+     - rounds: round names, e.g. ["Final", "1/2"]
+     - tourIDs: raw OnCourt tour IDs
+     - playerIDs: raw OnCourt player IDs, either player of a match will do
+    Call resolve() with the mappers to turn all of the above into sets of raw
+    tour/round/player IDs, after which accepts() only ever needs a row's raw
+    key (see rawKeyOf), so rejected rows never get dereferenced or parsed.
+    resolve() starts afresh each time, so one filter can be resolved against
+    each gender's mappers in turn
+    '''
+    def __init__(self, years=None, surfaces=None, rounds=None, tourIDs=None,
+                 playerIDs=None):
+        self._years = set(years) if years is not None else None
+        self._surfaces = surfaces
+        self._rounds = rounds
+        self._wantedTourIDs = set(tourIDs) if tourIDs is not None else None
+        self._playerIDs = set(playerIDs) if playerIDs is not None else None
+        self._tourIDs = None
+        self._roundIDs = None
+        self._resolved = False
+
+    def resolve(self, tourMapper, roundMapper):
+        '''
+        Both mappers must have been loaded
+        '''
+        self._tourIDs = self._wantedTourIDs
+        if self._years is not None or self._surfaces is not None:
+            tourIDs = tourMapper.getTourIDs(self._years, self._surfaces)
+            if self._wantedTourIDs is not None:
+                tourIDs &= self._wantedTourIDs
+            self._tourIDs = tourIDs
+        if self._rounds is not None:
+            self._roundIDs = roundMapper.getIDs(self._rounds)
+        self._resolved = True
+        if DEBUG: print "MatchFilter: %s tours, %s rounds, %s players" % tuple(
+                     len(ids) if ids is not None else "all" for ids in
+                     (self._tourIDs, self._roundIDs, self._playerIDs))
+
+    def accepts(self, rawKey):
+        if not self._resolved:
+            raise Exception("MatchFilter.accepts() called before resolve()")
+        winnerID, loserID, tourID, roundID = rawKey
+        return ((self._tourIDs is None or tourID in self._tourIDs) and
+                (self._roundIDs is None or roundID in self._roundIDs) and
+                (self._playerIDs is None or winnerID in self._playerIDs or
+                                            loserID in self._playerIDs))
+
+
 class ResultInfo:
     '''
     This encapsulates info about a match's score. Create one with no args, then
@@ -424,18 +1053,163 @@ class ResultInfo:
             if winnerGamesInSet == 6 and loserGamesInSet == 7:
                 result += 1
         return result
+
+    def getTotals(self):
+        '''
+        Returns the tuple of totals we print, in the order of Match.HEADER's
+        WSets to TotalTieBreaks columns
+        '''
+        return (self._winnerSetsWon,
+                self._loserSetsWon,
+                self.getWinnerGamesWon(),
+                self.getLoserGamesWon(),
+                self.getTotalGamesPlayed(),
+                self.getWinnerTieBreaksWon(),
+                self.getLoserTieBreaksWon(),
+                self.getWinnerTieBreaksWon() + self.getLoserTieBreaksWon())
         
     def __str__(self):
-        return "%s,%s,%s,%s,%s,%s,%s,%s" % (
-            self._winnerSetsWon,
-            self._loserSetsWon,
-            self.getWinnerGamesWon(),
-            self.getLoserGamesWon(),
-            self.getTotalGamesPlayed(),
-            self.getWinnerTieBreaksWon(),
-            self.getLoserTieBreaksWon(),
-            self.getWinnerTieBreaksWon() + self.getLoserTieBreaksWon()
-        )
+        return ",".join(str(total) for total in self.getTotals())
+
+class QuantileSketch(object):
+    '''
+    KLL-style quantile sketch: approximate quantiles of a stream of values in
+    bounded memory. Values go into a stack of compactors; when one fills up
+    it's sorted and every other value (odd or even ones, at random) moves up
+    to the next compactor, where each value counts twice as much. Lower
+    compactors get smaller capacities, so we hold O(k) values however many
+    are added
+    '''
+    def __init__(self, k=SKETCH_K, rng=None):
+        self._k = k
+        self._rng = rng or random.Random(0)
+        self._compactors = [list()]
+        self._held = 0     # values held across all compactors
+        self._maxHeld = 0
+        self.count = 0     # values added
+        self._setMaxHeld()
+
+    def _capacity(self, level):
+        depth = len(self._compactors) - level - 1
+        return int(math.ceil(self._k * (2.0 / 3) ** depth)) + 1
+
+    def _setMaxHeld(self):
+        self._maxHeld = sum(self._capacity(level)
+                            for level in xrange(len(self._compactors)))
+
+    def add(self, value):
+        self._compactors[0].append(value)
+        self._held += 1
+        self.count += 1
+        if self._held >= self._maxHeld:
+            self._compact()
+
+    def _compact(self):
+        for level in xrange(len(self._compactors)):
+            values = self._compactors[level]
+            if len(values) < self._capacity(level):
+                continue
+            if level + 1 == len(self._compactors):
+                self._compactors.append(list())
+                self._setMaxHeld()
+            values.sort()
+            # an odd one out stays where it is
+            kept = [values.pop()] if len(values) % 2 else []
+            promoted = values[self._rng.randint(0, 1)::2]
+            self._compactors[level + 1].extend(promoted)
+            self._compactors[level] = kept
+            self._held -= len(values) - len(promoted)
+            break
+
+    def quantile(self, q):
+        '''
+        Returns the (approximate) q-quantile, None if nothing was added
+        '''
+        weighted = sorted((value, 2 ** level)
+                          for level, values in enumerate(self._compactors)
+                          for value in values)
+        if not weighted:
+            return None
+        target = q * sum(weight for value, weight in weighted)
+        cumulative = 0
+        for value, weight in weighted:
+            cumulative += weight
+            if cumulative >= target:
+                return value
+        return weighted[-1][0]
+
+
+class StatQuantiles(object):
+    '''
+    QuantileSketches of every player stat and the duration, per surface and
+    year, for flagging outliers:
+     - Create one
+     - Call add() for every MatchStats
+     - Call flag() for every MatchStats (only once all are added)
+    Zeros are how OnCourt records stats it doesn't have, so we neither learn
+    from them nor flag them
+    '''
+    def __init__(self, quantiles=SUSPECT_QUANTILES,
+                 minCount=MIN_QUANTILE_COUNT):
+        self._quantiles = quantiles
+        self._minCount = minCount
+        self._statNames = (
+                AugmentedGamesfileGenerator.MatchStats.HEADER.split(","))
+        self._sketches = dict() # (surface, year, stat name) -> sketch
+        self._bands = dict()    # same key -> (low, high), None if too few
+        self._rng = random.Random(0) # shared, so results are repeatable
+
+    def _sketch(self, key):
+        if key not in self._sketches:
+            self._sketches[key] = QuantileSketch(rng=self._rng)
+        return self._sketches[key]
+
+    def add(self, surface, year, matchStats):
+        for playerStats in matchStats.getPlayerStats():
+            for statName, value in zip(self._statNames,
+                                       playerStats.asTuple()):
+                if value:
+                    self._sketch((surface, year, statName)).add(value)
+        if matchStats.getDuration():
+            self._sketch((surface, year, "Duration")).add(
+                                                  matchStats.getDuration())
+
+    def _band(self, key):
+        if key not in self._bands:
+            sketch = self._sketches.get(key)
+            if sketch is None or sketch.count < self._minCount:
+                self._bands[key] = None
+            else:
+                self._bands[key] = (sketch.quantile(self._quantiles[0]),
+                                    sketch.quantile(self._quantiles[1]))
+        return self._bands[key]
+
+    def _isOutlier(self, key, value):
+        band = self._band(key)
+        return bool(value) and band is not None and not (
+                                              band[0] <= value <= band[1])
+
+    def flag(self, surface, year, matchStats):
+        '''
+        addSuspectColumn()s matchStats' values outside their bands.
+        Returns True if we had a band for the duration
+        '''
+        for prefix, playerStats in zip(("W", "L"),
+                                       matchStats.getPlayerStats()):
+            for statName, value in zip(self._statNames,
+                                       playerStats.asTuple()):
+                if self._isOutlier((surface, year, statName), value):
+                    matchStats.addSuspectColumn("%s%s" % (prefix, statName))
+        key = (surface, year, "Duration")
+        if self._isOutlier(key, matchStats.getDuration()):
+            matchStats.addSuspectColumn("Duration")
+        return self._band(key) is not None
+
+    def summary(self):
+        learned = sum(1 for key in self._sketches if self._band(key))
+        return "%s stat/surface/year cells, %s with enough values" % (
+                                                 len(self._sketches), learned)
+
 
 class AugmentedGamesfileGenerator(object):
     '''
@@ -450,13 +1224,26 @@ class AugmentedGamesfileGenerator(object):
     loser.
 
     '''
-    def __init__(self, gender, wd, roundMapper, tourMapper, playerMapper):
+    # columns in the raw files after the 4 key columns: games_ has the result
+    # and date strings, stat_ has 40 integer stats and the match-time string
+    GAMES_INT_COLS, GAMES_STR_COLS = 0, 2
+    STATS_INT_COLS, STATS_STR_COLS = 40, 1
+
+    def __init__(self, gender, wd, roundMapper, tourMapper, playerMapper,
+                 useSnapshots=False, suspectQuantiles=SUSPECT_QUANTILES):
         self._wd   = wd                        # working dir used to find files
         self._gamesFile = GAMES_FILE % gender  # games_<gender>.csv filename
         self._statsFile = STATS_FILE % gender  # stat_<gender>.csv filename
         self._pmap = playerMapper              # PlayerMapper instance
         self._tmap = tourMapper                # TourMapper instance
         self._rmap = roundMapper               # RoundMapper instance
+        # read the raw files via binary snapshots? (see RawTableSnapshot)
+        self._useSnapshots = useSnapshots
+        # MatchFilter restricting which matches we load, see setFilter()
+        self._filter = None
+        # (low, high) quantiles outside which stats are suspect, see
+        # StatQuantiles. None to only use MatchStats.validate()'s checks
+        self._suspectQuantiles = suspectQuantiles
         # We need to keep the order of matches played per the original input,
         # so we'll need a list to store the match keys sequentially in here:
         self._matchKeys = list()
@@ -464,6 +1251,8 @@ class AugmentedGamesfileGenerator(object):
         self._matches = dict()
         # Map of MatchKey -> MatchStats
         self._stats = dict()
+        # Works out duplicate/orphan keys before we join games to stats
+        self._reconciler = MatchKeyReconciler()
 
     class Match(object):
         '''
@@ -477,16 +1266,19 @@ class AugmentedGamesfileGenerator(object):
         HEADER = "WName,Wage,LName,Lage,TourName,Surface,Country,Round,WSets,LSets," + \
                  "WGames,LGames,TotalGames,WTieBreaks,LTieBreaks," + \
                  "TotalTieBreaks,Date"
+        # the columns of HEADER that ResultInfo.getTotals() are for
+        RESULT_HEADER = "WSets,LSets,WGames,LGames,TotalGames,WTieBreaks," + \
+                        "LTieBreaks,TotalTieBreaks"
 
-        def __init__(self, winnerI, loserI, tour, tround, surf, country, result,
+        def __init__(self, winnerI, loserI, tour, surf, country, tround, result,
                      gdate):
                      
             self._winner = winnerI
             self._loser = loserI
             self._tour = tour
-            self._round = tround
             self._surface = surf
             self._country = country
+            self._round = tround
             self._date = None
             try:
                 self.setDate(gdate)
@@ -547,6 +1339,26 @@ class AugmentedGamesfileGenerator(object):
         @property
         def hasDate(self):
             return self._date is not None
+
+        @property
+        def date(self):
+            return self._date # "YYYY/M/D", None if we couldn't work it out
+
+        @property
+        def tourName(self):
+            return self._tour
+
+        @property
+        def surface(self):
+            return self._surface
+
+        @property
+        def roundName(self):
+            return self._round
+
+        @property
+        def result(self):
+            return self._result # a ResultInfo
         
         
         def __str__(self):
@@ -556,9 +1368,9 @@ class AugmentedGamesfileGenerator(object):
                     self._loser.name,
                     self._loser.getAgeAsOf(self._date),
                     self._tour,
-                    self._round,
                     self._surface,
                     self._country,
+                    self._round,
                     self._result,
                     self._date)
     
@@ -596,10 +1408,11 @@ class AugmentedGamesfileGenerator(object):
             self._suspectStats = list()
             self._validated = False # ensure we only call validate() once
         
-        def validate(self):
+        def validate(self, maxDuration=300):
             '''
             Updates self._suspectStats with names of columns which might have
-            incorrect data. Only heuristics and consistency checks possible
+            incorrect data. Only heuristics and consistency checks possible.
+            Durations over maxDuration minutes are suspect (None to not check)
             Returns: None
             Raises if called more than once
             NOTE THAT THIS IS NOT A READONLY METHOD - IT UPDATES STATE!!!
@@ -609,26 +1422,31 @@ class AugmentedGamesfileGenerator(object):
                 
             winnerProbs = self._winnerStats.validate()
             loserProbs  = self._loserStats.validate()
+            # first get on with the checks
+            checkedStats = list()
+            for wp in winnerProbs:
+                checkedStats.append("W%s" % wp)
+            for lp in loserProbs:
+                checkedStats.append("L%s" % lp)
+            if self._matchTime:
+                if maxDuration is not None and self._matchTime > maxDuration:
+                    checkedStats.append("Duration")
+            else:
+                checkedStats.append("Duration")
+
             suspectStats = list()
             # if we've externally been notified of bad info through a call to
             # the public addSuspectColumn, it's already in self._suspectStats,
             # but we base our analysis on the above (local) suspectStats list.
-            # So check, and if necessary, add to the local and clear the member
+            # So check, and if necessary, add to the local and clear the member.
+            # Columns our checks flag too (e.g. by StatQuantiles) are only
+            # listed once, by the checks
             if len(self._suspectStats):
-                suspectStats.extend(self._suspectStats)
+                suspectStats.extend(colName for colName in self._suspectStats
+                                    if colName not in checkedStats)
                 self._suspectStats = list()
-            
-            # and now get on with the checks
-            for wp in winnerProbs:
-                suspectStats.append("W%s" % wp)
-            for lp in loserProbs:
-                suspectStats.append("L%s" % lp)
-            if self._matchTime:
-                if self._matchTime > 300:
-                    suspectStats.append("Duration")
-            else:
-                suspectStats.append("Duration")
-                
+            suspectStats.extend(checkedStats)
+
             if (len(suspectStats)):
                 self._suspectStats.append("%s:" % len(suspectStats))
                 self._suspectStats.extend(suspectStats)
@@ -643,6 +1461,19 @@ class AugmentedGamesfileGenerator(object):
             about but hide from us, so let them do so through this method:
             '''
             self._suspectStats.append(colName)
+
+        def getSuspectColumns(self):
+            '''
+            Returns set of the names of suspect columns (e.g. Waces, Duration)
+            '''
+            return set(colName for colName in self._suspectStats
+                       if colName != "0" and not colName.endswith(":"))
+
+        def getPlayerStats(self):
+            return self._winnerStats, self._loserStats
+
+        def getDuration(self):
+            return self._matchTime # in minutes, None if we don't know
             
         def __str__(self):
             return "%s,%s,%s,%s" % (
@@ -682,6 +1513,7 @@ class AugmentedGamesfileGenerator(object):
                          fastestServeKph, avgFirstServeKph, avgSecondServeKph):
                 
                 def intorzero(i):
+                    if isinstance(i, int): return i # from a RawTableSnapshot
                     i = i.strip()
                     return int(i) if i else 0
                     
@@ -743,8 +1575,11 @@ class AugmentedGamesfileGenerator(object):
                     issues.append("fastestServeKph")
                 return issues
             
-            def __str__(self):
-                return ("%s,"*self.PLAYER_STATS_COUNT)[:-1] % (
+            def asTuple(self):
+                '''
+                Returns the stats in the order of MatchStats.HEADER
+                '''
+                return (
                     self._firstServesIn,
                     self._firstServes,
                     self._aces,
@@ -765,23 +1600,55 @@ class AugmentedGamesfileGenerator(object):
                     self._avgSecondServeKph,
                 )
 
+            def __str__(self):
+                return ("%s,"*self.PLAYER_STATS_COUNT)[:-1] % self.asTuple()
+
+    def setFilter(self, matchFilter):
+        '''
+        Only matches accepted by matchFilter (a MatchFilter) get loaded. Call
+        before load(); None turns filtering off again
+        '''
+        self._filter = matchFilter
+
     def load(self):
         '''
         This reads the games and stats files, dereferencing all the pesky IDs to
         names on the fly and joins up the MatchStats correspondingly.
         '''
-        # this will be a list<Match> of the file minus the header
-        matchList = None 
+        if self._filter:
+            self._filter.resolve(self._tmap, self._rmap)
+        # this will be a RawCsvTable/RawTableSnapshot of the games file
+        matchTable = None 
         
         fname = "%s/%s" % (self._wd, self._gamesFile)
         if DEBUG: print "AugmentedGamesfileGenerator: Reading %s" % fname
-        with open(fname , "r") as f:
-            f.readline() # skips the header
-            matchList = f.readlines()
+        matchTable = openRawTable(fname, self.GAMES_INT_COLS,
+                                  self.GAMES_STR_COLS, self._useSnapshots)
+
+        # read the stats up front too so that we can reconcile the keys of
+        # both files before doing any expensive joining
+        statsTable = None # and this will be the same for the stats file
+        fname = "%s/%s" % (self._wd, self._statsFile)
+        if DEBUG: print "AugmentedGamesfileGenerator: Reading %s" % fname
+        statsTable = openRawTable(fname, self.STATS_INT_COLS,
+                                  self.STATS_STR_COLS, self._useSnapshots)
+
+        self._reconciler.reconcile(matchTable.rawKeys(), statsTable.rawKeys())
         
         suspectDates = dict() # map of matchKey -> bool
-        for matchStr in matchList: # matchStr is a csv-string
-            elements = matchStr.replace('"','').strip().split(",")
+        # dupe raw keys we've already loaded once. A copy only counts once
+        # it's been stored, so a broken first copy doesn't lose the match
+        loadedDupKeys = set()
+        for i in xrange(len(matchTable)):
+            rawKey = matchTable.rawKey(i)
+            if self._filter and not self._filter.accepts(rawKey):
+                continue
+            if (self._reconciler.isDuplicateGame(rawKey) and
+                rawKey in loadedDupKeys):
+                print "WARNING: Skipping duplicate match %s" % (
+                                                      "/".join(rawKey))
+                continue
+            elements = matchTable.elements(i)
             (winnerID, loserID, tourID, roundID) = (elements[0],
                                                     elements[1],
                                                     elements[2],
@@ -821,6 +1688,8 @@ class AugmentedGamesfileGenerator(object):
                 
                 self._matches[matchKey] = match
                 self._matchKeys.append(matchKey)
+                if self._reconciler.isDuplicateGame(rawKey):
+                    loadedDupKeys.add(rawKey)
             except Exception as e:
                 print "Skipping match %s: %s" % (matchKey, e)
 
@@ -829,24 +1698,31 @@ class AugmentedGamesfileGenerator(object):
         if DEBUG:
             print "AugmentedGamesfileGenerator: Loaded %s/%s (%.1f) matches" % (
                          len(self._matches),
-                         len(matchList),
-                         len(self._matches)*100.0/len(matchList))
+                         len(matchTable),
+                         len(self._matches)*100.0/len(matchTable))
         
-        # now load in the stats
-        statsList = None # this will be a list<MatchStats> of the file
-        fname = "%s/%s" % (self._wd, self._statsFile)
-        if DEBUG: print "AugmentedGamesfileGenerator: Reading %s" % fname
-        with open(fname, "r") as f:
-            f.readline() # skips the header
-            statsList = f.readlines()
-        
-        for statsStr in statsList: # statsStr is a csv-string
-            elements = statsStr.replace('"','').strip().split(",")
-            (winnerID, loserID, tourID, roundID) = (elements[0],
-                                                    elements[1],
-                                                    elements[2],
-                                                    elements[3])
+        # now join in the stats
+        statQuantiles = None
+        if self._suspectQuantiles:
+            statQuantiles = StatQuantiles(self._suspectQuantiles)
+        loaded = list() # list<(matchKey, surface, year)> to validate
+        loadedDupKeys = set()
+        for i in xrange(len(statsTable)):
+            # orphans can't be written out, so don't bother parsing them
+            rawKey = statsTable.rawKey(i)
+            if self._reconciler.isOrphanStats(rawKey):
+                continue
+            if self._filter and not self._filter.accepts(rawKey):
+                continue
+            if (self._reconciler.isDuplicateStats(rawKey) and
+                rawKey in loadedDupKeys):
+                continue
+            (winnerID, loserID, tourID, roundID) = rawKey
             matchKey = MatchKey(winnerID, loserID, tourID, roundID)
+            # nor stats for matches we dropped while loading games
+            if matchKey not in self._matches:
+                continue
+            elements = statsTable.elements(i)
             winnerStats = AugmentedGamesfileGenerator.MatchStats.PlayerStats(
                             elements[4], elements[5],  # 1st server in, total
                             elements[6], elements[7],  # aces, doublefaults
@@ -878,12 +1754,47 @@ class AugmentedGamesfileGenerator(object):
                                                                 elements[44])
             if matchKey in suspectDates:
                 matchStats.addSuspectColumn("Date")
-            matchStats.validate()
+            match = self._matches[matchKey]
+            surface = match.surface
+            year = match.date.split("/")[0] if match.hasDate else None
+            if statQuantiles:
+                statQuantiles.add(surface, year, matchStats)
+            loaded.append((matchKey, surface, year))
             self._stats[matchKey] = matchStats
+            if self._reconciler.isDuplicateStats(rawKey):
+                loadedDupKeys.add(rawKey)
         
         if DEBUG: print "AugmentedGamesfileGenerator: Loaded %s stats" % (
                                                              len(self._stats))
 
+        # only now that we've seen every stat do we know what's an outlier.
+        # The learned duration band replaces validate()'s fixed limit
+        for matchKey, surface, year in loaded:
+            matchStats = self._stats[matchKey]
+            if statQuantiles and statQuantiles.flag(surface, year, matchStats):
+                matchStats.validate(maxDuration=None)
+            else:
+                matchStats.validate()
+        if DEBUG and statQuantiles:
+            print "AugmentedGamesfileGenerator: Quantiles of %s" % (
+                                                   statQuantiles.summary())
+
+    def matches(self):
+        '''
+        Generates (MatchKey, Match, MatchStats or None) for each match loaded,
+        in the order dump() writes them. For stages that run after load()
+        '''
+        for matchKey in self._matchKeys:
+            yield matchKey, self._matches[matchKey], self._stats.get(matchKey)
+
+    def writeReconciliationReport(self, destPath):
+        '''
+        Writes the duplicate/orphan MatchKey report worked out during load()
+        '''
+        if DEBUG: print "AugmentedGamesfileGenerator: Reconciliation to %s" % (
+                                                                     destPath)
+        self._reconciler.writeReport(destPath)
+
     def _createDummyStats(cls):
         '''
         Returns a long string filled with n/a
@@ -942,6 +1853,62 @@ class AugmentedGamesfileGenerator(object):
                                                               matchesWritten)
     
     
+class AugmentedGamesfileReader(object):
+    '''
+    Reads back a file written by AugmentedGamesfileGenerator.dump() for the
+    programs which work off our augmented data. Columns are looked up by their
+    header name, so those programs don't break if columns get added:
+     - Create one with the path of the augmented file
+     - Call load()
+     - Use col() to find the positions you want, then go through rows()
+    '''
+    NA = "n/a" # what dump() writes for stats of matches without any
+
+    def __init__(self, fname):
+        self._fname = fname
+        self._header = None     # the header line
+        self._colIndex = dict() # map of column-name -> position
+        self._rows = list()     # list<list<str>> of the file minus header
+
+    def load(self):
+        '''
+        Raises: BadHeaderError if the file doesn't look like one of ours
+        '''
+        if DEBUG: print "AugmentedGamesfileReader: Reading %s" % self._fname
+        with open(self._fname, "r") as f:
+            self._header = f.readline().strip()
+            header = self._header.split(",")
+            for line in f:
+                line = line.strip()
+                if line:
+                    self._rows.append(line.split(","))
+
+        if header[-1] != "MatchKey":
+            raise BadHeaderError("Couldn't read header in %s" % self._fname)
+        for i, colName in enumerate(header):
+            self._colIndex[colName] = i
+        if DEBUG: print "AugmentedGamesfileReader: Loaded %s matches" % (
+                                                             len(self._rows))
+
+    def col(self, colName):
+        '''
+        Returns the position of colName. Raises KeyError if no such column
+        '''
+        return self._colIndex[colName]
+
+    def getHeader(self):
+        return self._header
+
+    def hasStats(self, row):
+        return row[self._colIndex["SuspectColumns"]] != self.NA
+
+    def rows(self):
+        return self._rows
+
+    def __len__(self):
+        return len(self._rows)
+
+
 def doMain():
     genderCodes = ["atp", # men's
                    "wta"] # women's
@@ -955,6 +1922,15 @@ def doMain():
     courtMapper = CourtMapper(rawCsvDir, "ID_C", "NAME_C")
     courtMapper.load()
 
+    # the cube needs numpy, which the augmented files don't: without it we
+    # just skip the cube
+    try:
+        from match_cube import MatchCube, CUBE_FILE
+        cube = MatchCube()
+    except ImportError as e:
+        print "WARNING: Not building the match cube (%s)" % e
+        cube = None
+
     for gender in genderCodes:
         playerMapper = PlayerMapper(gender, rawCsvDir, "ID_P", "NAME_P", "DATE_P")
         playerMapper.load()
@@ -965,9 +1941,17 @@ def doMain():
     
     
         agg = AugmentedGamesfileGenerator(gender, rawCsvDir,
-                                          roundMapper, tourMapper, playerMapper)
+                                          roundMapper, tourMapper, playerMapper,
+                                          useSnapshots=True)
         agg.load()
         agg.dump("%s/augmented_games_%s.csv" % (outCsvDir, gender))
+        agg.writeReconciliationReport("%s/reconciliation_%s.txt" % (
+                                                           outCsvDir, gender))
+        if cube is not None:
+            cube.add(gender, agg)
+
+    if cube is not None:
+        cube.dump("%s/%s" % (outCsvDir, CUBE_FILE))
                               
     return 0
 
@@ -0,0 +1,284 @@
+#!/home/mzc/anaconda2/bin/python
+
+'''
+Program to build rolling per-player "form" features from the augmented games
+files written by augment_games_data.py
+
+Notes:
+ - for every match, and for each of its two players, we emit that player's
+   stats over their last N matches and over their last K days (see
+   MATCH_WINDOWS and DAY_WINDOWS) e.g. first-serve %, break points saved %,
+   aces per service game
+
+ - features are point-in-time correct: we walk the matches in date order and
+   a match only ever sees matches played on EARLIER dates. Matches on the
+   same date (e.g. several rounds of a tournament whose match-dates were
+   missing, so augment_games_data.py used the tour-date) don't see each other
+
+ - each player keeps running window sums, so the cost per match is constant
+   whatever the window size: for last-N windows the values leaving the window
+   come out of a fixed-size array-backed ring buffer, for last-K-days windows
+   they come out of a date-ordered queue
+
+ - players are identified by their OnCourt IDs, taken from the MatchKey column
+
+ - matches without stats ('n/a' columns) still count towards Matches and
+   WinPct, but not towards any of the stats-based features
+
+ - we don't know how many service games a player had, so we approximate it
+   as half the games played in the match
+
+ - a feature whose denominator is zero over the window is written as 'n/a'
+'''
+
+import array
+import collections
+import sys
+
+import augment_games_data
+from augment_games_data import AugmentedGamesfileReader, ymdToOrdinal
+
+MATCH_WINDOWS = (10, 50)  # last N matches
+DAY_WINDOWS   = (365,)    # last K days
+
+DEBUG = True
+
+# Per-match quantities we keep window sums of, from one player's perspective
+PLAYED, WON, WITH_STATS, SV_PTS, FIRST_SV_IN, FIRST_SV_PTS_WON, \
+    SECOND_SVS, SECOND_SV_PTS_WON, ACES, DOUBLE_FAULTS, BP_FACED, BP_SAVED, \
+    SV_GAMES, RECV_PTS_WON, RECV_PTS = range(15)
+N_QUANTITIES = 15
+
+# (feature name, numerator, denominator) - all features are ratios of sums
+FEATURES = (("Matches",        PLAYED,            None),
+            ("WinPct",         WON,               PLAYED),
+            ("FirstSvPct",     FIRST_SV_IN,       SV_PTS),
+            ("FirstSvWonPct",  FIRST_SV_PTS_WON,  FIRST_SV_IN),
+            ("SecondSvWonPct", SECOND_SV_PTS_WON, SECOND_SVS),
+            ("BpSavedPct",     BP_SAVED,          BP_FACED),
+            ("AcesPerSvGame",  ACES,              SV_GAMES),
+            ("DfsPerSvGame",   DOUBLE_FAULTS,     SV_GAMES),
+            ("RecvPtsWonPct",  RECV_PTS_WON,      RECV_PTS))
+
+
+def computeFeatures(sums):
+    '''
+    sums is a sequence of N_QUANTITIES window sums. Returns list<str>
+    '''
+    result = list()
+    for name, num, den in FEATURES:
+        if den is None:
+            result.append("%d" % sums[num])
+            continue
+        if sums[den] > 0:
+            result.append("%.4f" % (sums[num] / sums[den]))
+        else:
+            result.append("n/a")
+    return result
+
+
+class LastMatchesWindow(object):
+    '''
+    Running sums over a player's last n matches. The quantities of the
+    matches in the window live in a ring buffer: one flat array of n slots
+    of N_QUANTITIES each, so adding a match is O(N_QUANTITIES)
+    '''
+    def __init__(self, n):
+        self._n = n
+        self._ring = array.array("d", [0.0]) * (n * N_QUANTITIES)
+        self._sums = array.array("d", [0.0]) * N_QUANTITIES
+        self._next = 0   # slot the next match goes into
+        self._count = 0  # number of occupied slots
+
+    def add(self, dateOrdinal, quantities):
+        base = self._next * N_QUANTITIES
+        full = self._count == self._n
+        for q in xrange(N_QUANTITIES):
+            if full:
+                self._sums[q] -= self._ring[base + q]
+            self._ring[base + q] = quantities[q]
+            self._sums[q] += quantities[q]
+        self._next = (self._next + 1) % self._n
+        if not full:
+            self._count += 1
+
+    def sums(self, dateOrdinal):
+        return self._sums
+
+
+class LastDaysWindow(object):
+    '''
+    Running sums over a player's matches in the k days before a given date.
+    Matches are queued in date order and expire off the front of the queue
+    as the asked-for dates move forward (which they must only ever do)
+    '''
+    def __init__(self, k):
+        self._k = k
+        self._queue = collections.deque() # of (dateOrdinal, quantities)
+        self._sums = array.array("d", [0.0]) * N_QUANTITIES
+
+    def add(self, dateOrdinal, quantities):
+        self._queue.append((dateOrdinal, quantities))
+        for q in xrange(N_QUANTITIES):
+            self._sums[q] += quantities[q]
+
+    def sums(self, dateOrdinal):
+        oldest = dateOrdinal - self._k
+        while self._queue and self._queue[0][0] < oldest:
+            expired = self._queue.popleft()[1]
+            for q in xrange(N_QUANTITIES):
+                self._sums[q] -= expired[q]
+        return self._sums
+
+
+class PlayerFeatureStore(object):
+    '''
+    Walks matches in date order, emitting features for each player before
+    folding the match into that player's windows:
+     - Create one
+     - Call load() with an AugmentedGamesfileReader that's been loaded
+     - Call dump()
+    '''
+    STATS_COLS = ("firstSvIn", "firstSvTot", "aces", "doubleFaults",
+                  "firstSvPtsWon", "secondSvPtsWon", "breakPtsWon",
+                  "breakPtsTot", "recvPtsWon", "recvPtsTot")
+
+    def __init__(self, matchWindows=MATCH_WINDOWS, dayWindows=DAY_WINDOWS):
+        self._matchWindows = matchWindows
+        self._dayWindows = dayWindows
+        self._windows = dict() # map of playerID -> list of windows
+        # list<(matchKey, date, winner features, loser features)>
+        self._features = list()
+
+    def _windowsFor(self, playerID):
+        if playerID not in self._windows:
+            self._windows[playerID] = (
+                    [LastMatchesWindow(n) for n in self._matchWindows] +
+                    [LastDaysWindow(k) for k in self._dayWindows])
+        return self._windows[playerID]
+
+    @classmethod
+    def getHeader(cls, matchWindows=MATCH_WINDOWS, dayWindows=DAY_WINDOWS):
+        windowNames = (["last%s" % n for n in matchWindows] +
+                       ["last%sd" % k for k in dayWindows])
+        header = ["MatchKey", "Date"]
+        for player in ("W", "L"):
+            for windowName in windowNames:
+                header.extend(["%s%s_%s" % (player, windowName, name)
+                               for name, num, den in FEATURES])
+        return ",".join(header)
+
+    def _quantities(self, reader, row, me, opp, won):
+        '''
+        Returns the per-match quantities for player me ("W" or "L")
+        '''
+        q = [0.0] * N_QUANTITIES
+        q[PLAYED] = 1.0
+        q[WON] = 1.0 if won else 0.0
+        if not reader.hasStats(row):
+            return q
+        s = dict()
+        for colName in self.STATS_COLS:
+            s[me + colName] = float(row[reader.col(me + colName)])
+            s[opp + colName] = float(row[reader.col(opp + colName)])
+        q[WITH_STATS] = 1.0
+        q[SV_PTS] = s[me + "firstSvTot"]
+        q[FIRST_SV_IN] = s[me + "firstSvIn"]
+        q[FIRST_SV_PTS_WON] = s[me + "firstSvPtsWon"]
+        q[SECOND_SVS] = s[me + "firstSvTot"] - s[me + "firstSvIn"]
+        q[SECOND_SV_PTS_WON] = s[me + "secondSvPtsWon"]
+        q[ACES] = s[me + "aces"]
+        q[DOUBLE_FAULTS] = s[me + "doubleFaults"]
+        q[BP_FACED] = s[opp + "breakPtsTot"]
+        q[BP_SAVED] = s[opp + "breakPtsTot"] - s[opp + "breakPtsWon"]
+        q[SV_GAMES] = float(row[reader.col("TotalGames")]) / 2
+        q[RECV_PTS_WON] = s[me + "recvPtsWon"]
+        q[RECV_PTS] = s[me + "recvPtsTot"]
+        return q
+
+    def load(self, reader):
+        '''
+        Builds the features of every match in reader (already loaded)
+        '''
+        dateCol, keyCol = reader.col("Date"), reader.col("MatchKey")
+        # python's sort is stable, so same-date matches keep their file order
+        byDate = sorted(((ymdToOrdinal(row[dateCol]), row)
+                         for row in reader.rows()), key=lambda x: x[0])
+
+        # updates for the current date are held back until the date changes,
+        # so that same-date matches can't leak into each other's features
+        pending = list() # list<(windows, dateOrdinal, quantities)>
+        curDate = None
+        for dateOrdinal, row in byDate:
+            if dateOrdinal != curDate:
+                for windows, pendingDate, quantities in pending:
+                    for window in windows:
+                        window.add(pendingDate, quantities)
+                pending = list()
+                curDate = dateOrdinal
+
+            winnerID, loserID = row[keyCol].split("/")[0:2]
+            features = list()
+            for playerID, me, opp, won in ((winnerID, "W", "L", True),
+                                           (loserID,  "L", "W", False)):
+                windows = self._windowsFor(playerID)
+                playerFeatures = list()
+                for window in windows:
+                    playerFeatures.extend(
+                            computeFeatures(window.sums(dateOrdinal)))
+                features.append(playerFeatures)
+                pending.append((windows, dateOrdinal,
+                                self._quantities(reader, row, me, opp, won)))
+            self._features.append((row[keyCol], row[dateCol],
+                                   features[0], features[1]))
+
+        if DEBUG: print "PlayerFeatureStore: Built features for %s matches" % (
+                                        len(self._features))
+
+    def dump(self, destPath):
+        '''
+        Writes the features, one row per match in date order
+        '''
+        if DEBUG: print "PlayerFeatureStore: Dumping to %s" % destPath
+        header = self.getHeader(self._matchWindows, self._dayWindows)
+        nHeaderColumns = len(header.split(","))
+        bufSz = 5000
+        with open(destPath, "wb") as outfile:
+            outfile.write("%s\n" % header)
+            buf = list()
+            for matchKey, date, wFeatures, lFeatures in self._features:
+                row = ",".join([matchKey, date] + wFeatures + lFeatures)
+                if len(row.split(",")) != nHeaderColumns:
+                    raise Exception("Header has %s columns but a row has %s: "
+                                    "Row=%s" % (nHeaderColumns,
+                                                len(row.split(",")), row))
+                buf.append(row)
+                if len(buf) == bufSz:
+                    outfile.write("\n".join(buf))
+                    outfile.write("\n")
+                    buf = list()
+            if buf:
+                outfile.write("\n".join(buf))
+                outfile.write("\n")
+
+
+def doMain():
+    genderCodes = ["atp", # men's
+                   "wta"] # women's
+    csvDir = "/home/mzc/dev/tennis/oncourt/data/csv" # augmented files dir
+    if len(sys.argv) > 1:
+        csvDir = sys.argv[1]
+    augment_games_data.DEBUG = DEBUG
+
+    for gender in genderCodes:
+        reader = AugmentedGamesfileReader("%s/augmented_games_%s.csv" % (
+                                                             csvDir, gender))
+        reader.load()
+        store = PlayerFeatureStore()
+        store.load(reader)
+        store.dump("%s/player_features_%s.csv" % (csvDir, gender))
+
+    return 0
+
+if __name__ == "__main__":
+   doMain()
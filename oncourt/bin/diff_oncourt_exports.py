@@ -0,0 +1,206 @@
+#!/home/mzc/anaconda2/bin/python
+
+'''
+Program to work out what changed between two OnCourt exports (directories of
+raw csvs, as read by augment_games_data.py) without diffing huge files
+
+Notes:
+ - every row is boiled down to a content fingerprint (8 bytes of its md5),
+   keyed by MatchKey for games_ and stat_ rows and by ID for players_,
+   tours_, rounds and courts rows. Fingerprints are taken of rows as
+   augment_games_data.py sees them (quotes and surrounding whitespace gone)
+
+ - each file of each export is read once, streaming: only the fingerprints
+   are held in memory (8 bytes plus the key per row), never the rows
+
+ - a key appearing more than once in a file gets one fingerprint covering
+   all of its rows, in order
+
+ - for each table we write diff_<table>.txt, listing added, removed and
+   changed keys. For each gender we also write reprocess_<gender>.txt: the
+   MatchKeys (of the new export) whose games rows were added or changed,
+   whose stat rows were added, changed or removed, or which involve a
+   player, tour or round which was added or changed. That's the list to
+   drive targeted reprocessing with. Changes to courts aren't followed
+   through to matches - they're rare enough that a full rebuild is the
+   thing to do
+
+ - usage: diff_oncourt_exports.py <old export dir> <new export dir> <out dir>
+'''
+
+import hashlib
+import sys
+
+from augment_games_data import (PLAYERS_FILE, TOURS_FILE, GAMES_FILE,
+                                STATS_FILE, ROUNDS_FILE, COURTS_FILE,
+                                BadHeaderError, rawKeyOf)
+
+DEBUG = True
+
+
+def fingerprint(row, previous=""):
+    return hashlib.md5(previous + row).digest()[:8]
+
+
+class TableFingerprints(object):
+    '''
+    Fingerprints of one raw csv file, keyed by either the 4-part MatchKey
+    (idColumn None) or the value of the column named idColumn
+    '''
+    def __init__(self, fname, idColumn=None):
+        self._fname = fname
+        self._idColumn = idColumn
+        self._idPosition = None
+
+    def _readHeader(self, f):
+        header = f.readline().strip()
+        if self._idColumn is None:
+            return
+        colNames = header.replace('"','').split(",")
+        if self._idColumn not in colNames:
+            raise BadHeaderError("Couldn't read header in %s: no %s" % (
+                                                self._fname, self._idColumn))
+        self._idPosition = colNames.index(self._idColumn)
+
+    def rows(self):
+        '''
+        Generates (key, normalized row) for every row of the file. Keys are
+        MatchKey strings (e.g. 1/2/3/4) or IDs
+        '''
+        with open(self._fname, "r") as f:
+            self._readHeader(f)
+            for line in f:
+                row = line.replace('"','').strip()
+                if not row:
+                    continue
+                if self._idPosition is None:
+                    key = "/".join(rawKeyOf(row))
+                else:
+                    key = row.split(",")[self._idPosition]
+                yield key, row
+
+    def load(self):
+        '''
+        Returns map of key -> fingerprint
+        '''
+        fingerprints = dict()
+        for key, row in self.rows():
+            fingerprints[key] = fingerprint(row, fingerprints.get(key, ""))
+        return fingerprints
+
+
+class TableDiff(object):
+    '''
+    Compares one table between an old and a new export:
+     - Create one with both TableFingerprints
+     - Call diff(), optionally with a callback for each row of the new table
+     - Call dump()
+    '''
+    def __init__(self, name, oldTable, newTable):
+        self.name = name
+        self._old = oldTable
+        self._new = newTable
+        self.added, self.removed, self.changed = set(), set(), set()
+
+    def diff(self, onNewRow=None):
+        '''
+        onNewRow(key, row) is called for each row of the new table, which
+        saves callers making another pass over it
+        '''
+        old = self._old.load()
+        seen = dict() # key -> fingerprint so far, for keys of the new table
+        for key, row in self._new.rows():
+            seen[key] = fingerprint(row, seen.get(key, ""))
+            if onNewRow:
+                onNewRow(key, row)
+        # only now are the fingerprints of repeated keys complete
+        for key, fp in seen.iteritems():
+            oldFp = old.pop(key, None)
+            if oldFp is None:
+                self.added.add(key)
+            elif oldFp != fp:
+                self.changed.add(key)
+        self.removed = set(old)
+        if DEBUG: print "TableDiff: %s" % self.summary()
+
+    def summary(self):
+        return "%s: added=%s removed=%s changed=%s" % (
+                  self.name, len(self.added), len(self.removed),
+                  len(self.changed))
+
+    def dump(self, destPath):
+        with open(destPath, "w") as f:
+            f.write("%s\n" % self.summary())
+            for title, keys in (("added", self.added),
+                                ("removed", self.removed),
+                                ("changed", self.changed)):
+                f.write("[%s]\n" % title)
+                for key in sorted(keys):
+                    f.write("%s\n" % key)
+
+
+def diffExports(oldDir, newDir, outDir, genderCodes):
+    def tableDiff(fname, idColumn):
+        return TableDiff(
+                fname,
+                TableFingerprints("%s/%s" % (oldDir, fname), idColumn),
+                TableFingerprints("%s/%s" % (newDir, fname), idColumn))
+
+    diffs = list()
+    rounds = tableDiff(ROUNDS_FILE, "ID_R")
+    rounds.diff()
+    courts = tableDiff(COURTS_FILE, "ID_C")
+    courts.diff()
+    diffs.extend([rounds, courts])
+    changedRounds = rounds.added | rounds.changed
+
+    for gender in genderCodes:
+        players = tableDiff(PLAYERS_FILE % gender, "ID_P")
+        players.diff()
+        tours = tableDiff(TOURS_FILE % gender, "ID_T")
+        tours.diff()
+        changedPlayers = players.added | players.changed
+        changedTours = tours.added | tours.changed
+
+        # matches of the new export involving anything changed above
+        reprocess = set()
+        gameKeys = set() # every match of the new export
+        def checkMatch(matchKey, row):
+            gameKeys.add(matchKey)
+            winnerID, loserID, tourID, roundID = matchKey.split("/")
+            if (winnerID in changedPlayers or loserID in changedPlayers or
+                tourID in changedTours or roundID in changedRounds):
+                reprocess.add(matchKey)
+
+        games = tableDiff(GAMES_FILE % gender, None)
+        games.diff(checkMatch)
+        stats = tableDiff(STATS_FILE % gender, None)
+        stats.diff()
+        diffs.extend([players, tours, games, stats])
+
+        reprocess |= games.added | games.changed
+        # a match whose stats went is still there, with n/a stats
+        reprocess |= (stats.added | stats.changed | stats.removed) & gameKeys
+        fname = "%s/reprocess_%s.txt" % (outDir, gender)
+        if DEBUG: print "diffExports: %s matches to reprocess -> %s" % (
+                                                    len(reprocess), fname)
+        with open(fname, "w") as f:
+            for matchKey in sorted(reprocess):
+                f.write("%s\n" % matchKey)
+
+    for d in diffs:
+        d.dump("%s/diff_%s.txt" % (outDir, d.name.replace(".csv", "")))
+
+
+def doMain():
+    genderCodes = ["atp", # men's
+                   "wta"] # women's
+    if len(sys.argv) != 4:
+        print "usage: %s <old export dir> <new export dir> <out dir>" % (
+                                                                 sys.argv[0])
+        return 1
+    diffExports(sys.argv[1], sys.argv[2], sys.argv[3], genderCodes)
+    return 0
+
+if __name__ == "__main__":
+   sys.exit(doMain())
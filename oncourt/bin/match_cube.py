@@ -0,0 +1,303 @@
+#!/home/mzc/anaconda2/bin/python
+
+'''
+Pre-aggregated cube of match data by gender x year x surface x tour x round,
+so reports (average aces by surface per year, tie-breaks by round, match
+durations over time...) never have to go through the matches themselves
+
+Notes:
+ - the cube is built by augment_games_data.py after each gender's load(),
+   see MatchCube.add(), and saved next to the augmented files as
+   match_cube.npz. This program reads it back and answers queries
+
+ - measures are the result totals (WSets to TotalTieBreaks), every W/L
+   player stat and Duration. For each cell we keep the number of matches
+   and, per measure, how many values went in (n), their sum and their sum of
+   squares - enough for means and standard deviations at any level of
+   roll-up. Matches without stats only count towards the result totals, and
+   values in columns validate() found suspect are left out. So are zeros in
+   the stats OnCourt only records for some matches (see UNRECORDED_IF_ZERO),
+   where a zero means it wasn't recorded
+
+ - only cells with matches in them are stored: an int32 array of dimension
+   value codes per cell plus n/sum/sum-of-squares arrays (cells x measures),
+   with each dimension's values stored once. Roll-ups and slices are numpy
+   group-bys over those arrays and give back another (smaller) MatchCube
+
+ - usage: match_cube.py <cube file> <dim,dim,...> [dim=value ...]
+                        [measures=measure,measure,...]
+   groups by the given dimensions (give "" to roll everything up), keeping
+   only cells whose dimensions have the given values, and writes a csv of
+   matches and the count/mean/std of each measure for each group to stdout
+'''
+
+import csv
+import sys
+
+import numpy as np
+
+import augment_games_data
+from augment_games_data import AugmentedGamesfileGenerator
+
+DIMENSIONS = ("Gender", "Year", "Surface", "TourName", "Round")
+MEASURES = tuple(
+    AugmentedGamesfileGenerator.Match.RESULT_HEADER.split(",") +
+    AugmentedGamesfileGenerator.MatchStats.getFullHeader().split(",")[:-1])
+# stats OnCourt leaves at 0 when it doesn't have them
+UNRECORDED_IF_ZERO = frozenset(["unforcedErrs", "winners", "netApproachWon",
+                                "netApproachTot", "fastestServeKph",
+                                "avgFirstSvKph", "avgSecondSvKph"])
+CUBE_FILE = "match_cube.npz"
+BATCH_MATCHES = 50000 # matches aggregated at a time while building
+
+DEBUG = True
+
+
+class MatchCube(object):
+    '''
+    To build one:
+     - Create one
+     - Call add() for each gender's AugmentedGamesfileGenerator after load()
+     - Call dump()
+    To query one: MatchCube.read() it, then rollUp() / slice() and go
+    through rows(), or use count()/mean()/std() on the arrays
+    '''
+    def __init__(self, dimensions=DIMENSIONS, measures=MEASURES):
+        self.dimensions = tuple(dimensions)
+        self.measures = tuple(measures)
+        # per dimension: list of values, and map of value -> code
+        self._values = [list() for d in self.dimensions]
+        self._codes = [dict() for d in self.dimensions]
+        self._cellIndex = dict() # tuple of codes -> cell, while building
+        self.coords = np.zeros((0, len(self.dimensions)), dtype=np.int32)
+        self.matches = np.zeros(0, dtype=np.int64)
+        self.n = np.zeros((0, len(self.measures)), dtype=np.int64)
+        self.sums = np.zeros((0, len(self.measures)))
+        self.sumSquares = np.zeros((0, len(self.measures)))
+
+    def _code(self, dim, value):
+        codes = self._codes[dim]
+        if value not in codes:
+            codes[value] = len(self._values[dim])
+            self._values[dim].append(value)
+        return codes[value]
+
+    def add(self, gender, generator):
+        '''
+        Adds the matches of an AugmentedGamesfileGenerator that's been loaded
+        '''
+        resultCols = len(AugmentedGamesfileGenerator.Match.RESULT_HEADER.
+                         split(","))
+        statNames = AugmentedGamesfileGenerator.MatchStats.HEADER.split(",")
+        coords, values = list(), list()
+        nAdded, nUndated = 0, 0
+        for matchKey, match, stats in generator.matches():
+            if not match.hasDate:
+                nUndated += 1
+                continue
+            coords.append((self._code(0, gender),
+                           self._code(1, match.date.split("/")[0]),
+                           self._code(2, match.surface),
+                           self._code(3, match.tourName),
+                           self._code(4, match.roundName)))
+            row = list(match.result.getTotals())
+            if stats:
+                suspect = stats.getSuspectColumns()
+                winnerStats, loserStats = stats.getPlayerStats()
+                for prefix, playerStats in (("W", winnerStats),
+                                            ("L", loserStats)):
+                    row.extend(
+                        np.nan if "%s%s" % (prefix, name) in suspect or
+                        (value == 0 and name in UNRECORDED_IF_ZERO)
+                        else value
+                        for name, value in zip(statNames,
+                                               playerStats.asTuple()))
+                duration = stats.getDuration()
+                row.append(duration if duration and
+                           "Duration" not in suspect else np.nan)
+            else:
+                row.extend([np.nan] * (len(self.measures) - resultCols))
+            values.append(row)
+            nAdded += 1
+            if len(coords) == BATCH_MATCHES:
+                self._addBatch(coords, values)
+                coords, values = list(), list()
+        if coords:
+            self._addBatch(coords, values)
+        if DEBUG: print "MatchCube: Added %s %s matches (%s undated)" % (
+                                                  nAdded, gender, nUndated)
+
+    def _addBatch(self, coords, values):
+        coords = np.array(coords, dtype=np.int32)
+        values = np.array(values, dtype=float)
+        cellCoords, inverse = np.unique(coords, axis=0, return_inverse=True)
+        # where each of the batch's cells goes in the whole cube
+        cells = np.empty(len(cellCoords), dtype=np.int64)
+        newCells = list()
+        for i, cellCoord in enumerate(map(tuple, cellCoords)):
+            if cellCoord not in self._cellIndex:
+                self._cellIndex[cellCoord] = len(self.coords) + len(newCells)
+                newCells.append(cellCoord)
+            cells[i] = self._cellIndex[cellCoord]
+        if newCells:
+            nNew = len(newCells)
+            self.coords = np.vstack([self.coords,
+                                     np.array(newCells, dtype=np.int32)])
+            self.matches = np.concatenate([self.matches,
+                                           np.zeros(nNew, dtype=np.int64)])
+            self.n, self.sums, self.sumSquares = [
+                    np.vstack([a, np.zeros((nNew, a.shape[1]), dtype=a.dtype)])
+                    for a in (self.n, self.sums, self.sumSquares)]
+
+        known = ~np.isnan(values)
+        values = np.where(known, values, 0.0)
+        np.add.at(self.matches, cells[inverse], 1)
+        np.add.at(self.n, cells[inverse], known)
+        np.add.at(self.sums, cells[inverse], values)
+        np.add.at(self.sumSquares, cells[inverse], values * values)
+
+    def __len__(self):
+        return len(self.coords)
+
+    def getValues(self, dimension):
+        return list(self._values[self.dimensions.index(dimension)])
+
+    def rollUp(self, groupBy, where=None):
+        '''
+        Returns a new MatchCube of just the groupBy dimensions, summing up the
+        cells of all the others. where is a map of dimension -> value, or
+        collection of values, restricting which cells go in
+        '''
+        mask = np.ones(len(self.coords), dtype=bool)
+        for dimension, wanted in (where or dict()).iteritems():
+            dim = self.dimensions.index(dimension)
+            if isinstance(wanted, basestring):
+                wanted = [wanted]
+            codes = [self._codes[dim][v] for v in wanted
+                     if v in self._codes[dim]]
+            mask &= np.in1d(self.coords[:, dim], codes)
+
+        keep = [self.dimensions.index(dimension) for dimension in groupBy]
+        cube = MatchCube(groupBy, self.measures)
+        cube._values = [list(self._values[dim]) for dim in keep]
+        cube._codes = [dict(self._codes[dim]) for dim in keep]
+        coords = self.coords[mask][:, keep]
+        if not len(coords):
+            return cube
+        if keep:
+            cube.coords, inverse = np.unique(coords, axis=0,
+                                             return_inverse=True)
+        else: # the grand total
+            cube.coords = np.zeros((1, 0), dtype=np.int32)
+            inverse = np.zeros(len(coords), dtype=np.int64)
+        nCells = len(cube.coords)
+        cube.matches = np.bincount(inverse, weights=self.matches[mask],
+                                   minlength=nCells).astype(np.int64)
+        for name in ("n", "sums", "sumSquares"):
+            summed = np.zeros((nCells, len(self.measures)),
+                              dtype=getattr(self, name).dtype)
+            np.add.at(summed, inverse, getattr(self, name)[mask])
+            setattr(cube, name, summed)
+        return cube
+
+    def slice(self, where):
+        '''
+        rollUp() keeping all the dimensions
+        '''
+        return self.rollUp(self.dimensions, where)
+
+    def count(self, measure):
+        return self.n[:, self.measures.index(measure)]
+
+    def mean(self, measure):
+        m = self.measures.index(measure)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.sums[:, m] / self.n[:, m]
+
+    def std(self, measure):
+        '''
+        Population standard deviation
+        '''
+        m = self.measures.index(measure)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self.sums[:, m] / self.n[:, m]
+            variance = self.sumSquares[:, m] / self.n[:, m] - mean * mean
+        return np.sqrt(np.maximum(variance, 0.0))
+
+    def rows(self, measures=None):
+        '''
+        Generates (list<dimension value>, matches, list<(n, mean, std)>) per
+        cell, sorted by dimension values
+        '''
+        measures = measures or self.measures
+        stats = [(self.count(m), self.mean(m), self.std(m)) for m in measures]
+        labels = [[self._values[d][code] for d, code in enumerate(coord)]
+                  for coord in self.coords]
+        for i in sorted(xrange(len(self.coords)), key=lambda i: labels[i]):
+            yield (labels[i], self.matches[i],
+                   [(n[i], mean[i], std[i]) for n, mean, std in stats])
+
+    def dump(self, destPath):
+        if DEBUG: print "MatchCube: Dumping %s cells to %s" % (len(self),
+                                                               destPath)
+        arrays = dict(("values%s" % d, np.array(values, dtype=str))
+                      for d, values in enumerate(self._values))
+        np.savez_compressed(destPath,
+                            dimensions=np.array(self.dimensions, dtype=str),
+                            measures=np.array(self.measures, dtype=str),
+                            coords=self.coords, matches=self.matches,
+                            n=self.n, sums=self.sums,
+                            sumSquares=self.sumSquares, **arrays)
+
+    @classmethod
+    def read(cls, srcPath):
+        data = np.load(srcPath)
+        cube = cls([str(d) for d in data["dimensions"]],
+                   [str(m) for m in data["measures"]])
+        cube._values = [[str(v) for v in data["values%s" % d]]
+                        for d in xrange(len(cube.dimensions))]
+        cube._codes = [dict((v, code) for code, v in enumerate(values))
+                       for values in cube._values]
+        for name in ("coords", "matches", "n", "sums", "sumSquares"):
+            setattr(cube, name, data[name])
+        if DEBUG: print "MatchCube: Read %s cells from %s" % (len(cube),
+                                                              srcPath)
+        return cube
+
+
+def doMain():
+    if len(sys.argv) < 3:
+        print ("usage: %s <cube file> <dim,dim,...> [dim=value ...] "
+               "[measures=measure,measure,...]" % sys.argv[0])
+        return 1
+    augment_games_data.DEBUG = False
+    global DEBUG
+    DEBUG = False # stdout is for the csv
+
+    cube = MatchCube.read(sys.argv[1])
+    groupBy = [d for d in sys.argv[2].split(",") if d]
+    where, measures = dict(), None
+    for arg in sys.argv[3:]:
+        name, value = arg.split("=", 1)
+        if name == "measures":
+            measures = value.split(",")
+        else:
+            where.setdefault(name, list()).append(value)
+
+    cube = cube.rollUp(groupBy, where)
+    measures = measures or cube.measures
+    writer = csv.writer(sys.stdout, lineterminator="\n")
+    header = groupBy + ["Matches"]
+    for m in measures:
+        header.extend(["%sCount" % m, "%sMean" % m, "%sStd" % m])
+    writer.writerow(header)
+    for labels, matches, stats in cube.rows(measures):
+        row = labels + [matches]
+        for n, mean, std in stats:
+            row.extend([n, "%.4f" % mean, "%.4f" % std] if n else
+                       [0, "n/a", "n/a"])
+        writer.writerow(row)
+    return 0
+
+if __name__ == "__main__":
+   sys.exit(doMain())
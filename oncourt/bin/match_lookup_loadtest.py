@@ -0,0 +1,167 @@
+#!/home/mzc/anaconda2/bin/python
+
+'''
+Program to load-test match_lookup_server.py and report its latencies
+
+Notes:
+ - queries are picked at random from an augmented games file (the same one
+   the server is serving, ideally): a mix of /match, /player and /tournament
+   lookups, see QUERY_MIX. Picking from a limited pool of players/tours
+   (see POOL_SIZE) means the server's LRU cache gets exercised too
+
+ - before the run we check that a match with non-ascii text (an accented
+   name, say) can be looked up, since that's what breaks first
+
+ - THREADS clients each send REQUESTS_PER_THREAD requests over their own
+   kept-alive connection, and we report p50/p90/p99/max latency per query
+   type and overall, plus throughput. If any request fails we list some of
+   the failures instead and exit with 1: latencies of failures mean nothing
+
+ - usage: match_lookup_loadtest.py <augmented file> <gender> [port]
+'''
+
+import httplib
+import random
+import sys
+import threading
+import time
+import urllib
+
+import augment_games_data
+from augment_games_data import AugmentedGamesfileReader
+from match_lookup_server import HOST, PORT
+
+THREADS = 8
+REQUESTS_PER_THREAD = 2000
+POOL_SIZE = 2000 # distinct keys/players/tours to choose queries from
+ERRORS_SHOWN = 10
+QUERY_MIX = (("/match", 0.6), ("/player", 0.3), ("/tournament", 0.1))
+
+DEBUG = False
+
+
+def percentile(sortedValues, pct):
+    if not sortedValues:
+        return float("nan")
+    return sortedValues[min(len(sortedValues) - 1,
+                            int(len(sortedValues) * pct / 100.0))]
+
+
+def loadKeys(fname):
+    '''
+    Returns (list<MatchKey>, a MatchKey of a row with non-ascii text or None)
+    '''
+    reader = AugmentedGamesfileReader(fname)
+    reader.load()
+    keys, nonAsciiKey = list(), None
+    for row in reader.rows():
+        keys.append(row[reader.col("MatchKey")])
+        if nonAsciiKey is None and any(ord(c) > 127 for c in "".join(row)):
+            nonAsciiKey = keys[-1]
+    return keys, nonAsciiKey
+
+
+def buildQueries(keys, gender, nQueries, seed=0):
+    '''
+    Returns list<(query type, url)> picked at random from keys
+    '''
+    rng = random.Random(seed)
+    pool = rng.sample(keys, min(POOL_SIZE, len(keys)))
+    queries = list()
+    for x in xrange(nQueries):
+        matchKey = rng.choice(pool)
+        winnerID, loserID, tourID, roundID = matchKey.split("/")
+        r = rng.random()
+        for path, share in QUERY_MIX:
+            r -= share
+            if r < 0:
+                break
+        if path == "/match":
+            params = {"key": matchKey}
+        elif path == "/player":
+            params = {"id": rng.choice((winnerID, loserID)), "n": 10}
+        else:
+            params = {"id": tourID}
+        params["gender"] = gender
+        queries.append((path, "%s?%s" % (path, urllib.urlencode(params))))
+    return queries
+
+
+def runClient(port, queries, latencies, errors):
+    conn = httplib.HTTPConnection(HOST, port)
+    for path, url in queries:
+        start = time.time()
+        conn.request("GET", url)
+        response = conn.getresponse()
+        response.read()
+        latencies.append((path, time.time() - start))
+        if response.status != 200:
+            errors.append(url)
+    conn.close()
+
+
+def checkNonAscii(port, matchKey, gender):
+    '''
+    Returns True if the match comes back fine
+    '''
+    conn = httplib.HTTPConnection(HOST, port)
+    conn.request("GET", "/match?%s" % urllib.urlencode({"key": matchKey,
+                                                        "gender": gender}))
+    response = conn.getresponse()
+    body = response.read()
+    conn.close()
+    if response.status != 200:
+        print "ERROR: Match %s with non-ascii text failed (%s): %s" % (
+                                           matchKey, response.status, body)
+        return False
+    return True
+
+
+def doMain():
+    if len(sys.argv) < 3:
+        print "usage: %s <augmented file> <gender> [port]" % sys.argv[0]
+        return 1
+    gender = sys.argv[2]
+    port = int(sys.argv[3]) if len(sys.argv) > 3 else PORT
+    augment_games_data.DEBUG = DEBUG
+
+    keys, nonAsciiKey = loadKeys(sys.argv[1])
+    if nonAsciiKey is None:
+        print "WARNING: No match with non-ascii text to check"
+    elif not checkNonAscii(port, nonAsciiKey, gender):
+        return 1
+    queries = buildQueries(keys, gender, THREADS * REQUESTS_PER_THREAD)
+    latencies, errors = list(), list() # list.append is thread-safe
+    threads = [threading.Thread(target=runClient,
+                                args=(port,
+                                      queries[i::THREADS],
+                                      latencies, errors))
+               for i in xrange(THREADS)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    print "%s requests from %s threads in %.2fs (%.0f req/s), %s errors" % (
+            len(latencies), THREADS, elapsed, len(latencies) / elapsed,
+            len(errors))
+    if errors:
+        print "ERROR: Not reporting latencies, failed requests include:"
+        for url in errors[:ERRORS_SHOWN]:
+            print "  %s" % url
+        return 1
+    print "%-12s %8s %8s %8s %8s %8s" % ("query", "count", "p50ms", "p90ms",
+                                         "p99ms", "maxms")
+    for path in [p for p, share in QUERY_MIX] + ["all"]:
+        values = sorted(l * 1000 for p, l in latencies
+                        if path == "all" or p == path)
+        print "%-12s %8s %8.2f %8.2f %8.2f %8.2f" % (
+                path, len(values), percentile(values, 50),
+                percentile(values, 90), percentile(values, 99),
+                values[-1] if values else float("nan"))
+    return 0
+
+if __name__ == "__main__":
+   sys.exit(doMain())
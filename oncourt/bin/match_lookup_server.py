@@ -0,0 +1,304 @@
+#!/home/mzc/anaconda2/bin/python
+
+'''
+Program to serve lookups over the augmented games files written by
+augment_games_data.py, so our tools don't each have to parse them
+
+Notes:
+ - it's a plain HTTP server on localhost (see HOST, PORT), one thread per
+   connection. Every response is JSON: {"columns": [...], "rows": [[...]]}
+   where columns is the augmented file's header (plus "Gender") and rows
+   are matches, or {"error": "..."} with a 4xx status:
+     /match?key=<MatchKey>                     one match
+     /player?id=<playerID>&n=<N>&gender=<g>    a player's last N matches
+     /player?name=<player name>&n=<N>          same, by (case-insensitive) name
+     /tournament?id=<tourID>&gender=<g>        all matches of a tournament
+   gender is atp or wta. Player and tour IDs are only unique within a
+   gender, so queries by ID need one; the others search both genders unless
+   given one
+
+ - the augmented files' text is OnCourt's, i.e. cp1252 (see TEXT_ENCODING),
+   and gets decoded for the JSON. Bytes cp1252 doesn't have come out as
+   U+FFFD rather than failing the query
+
+ - each file is loaded once and indexed by MatchKey, player ID and tour ID
+   (players and tours are taken from the MatchKey column). Responses are kept
+   in an LRU cache (see CACHE_SIZE) since tools tend to repeat themselves
+
+ - we poll the files' mtimes (see RELOAD_POLL_SECONDS) and reload any file
+   that's changed, i.e. after augment_games_data.py has dumped a new one. We
+   wait until a file has looked the same for two polls in a row, so we don't
+   load one that's half-written. The new indexes (and an empty cache) are
+   swapped in in one go, requests in flight finish on the old ones
+
+ - see match_lookup_loadtest.py for latency numbers
+'''
+
+import BaseHTTPServer
+import SocketServer
+import collections
+import json
+import os
+import sys
+import threading
+import time
+import urlparse
+
+import augment_games_data
+from augment_games_data import AugmentedGamesfileReader, ymdToOrdinal
+
+HOST = "127.0.0.1"
+PORT = 8765
+CACHE_SIZE = 10000          # responses
+RELOAD_POLL_SECONDS = 5
+DEFAULT_LAST_MATCHES = 10
+TEXT_ENCODING = "cp1252" # OnCourt's a windows app
+
+DEBUG = True
+
+
+class LRUCache(object):
+    '''
+    A small thread-safe least-recently-used cache
+    '''
+    def __init__(self, maxSize):
+        self._maxSize = maxSize
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits, self.misses = 0, 0
+
+    def get(self, key):
+        '''
+        Returns None if key isn't cached
+        '''
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries[key] = value # now the most recently used
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            if len(self._entries) > self._maxSize:
+                self._entries.popitem(last=False)
+
+
+class MatchIndex(object):
+    '''
+    In-memory indexes over one augmented games file. Never modified once
+    built, a reload builds a new one
+    '''
+    def __init__(self, gender, fname):
+        self.gender = gender
+        self._fname = fname
+        self._rows = list()
+        self._byKey = dict()      # MatchKey -> row
+        self._byPlayer = dict()   # player ID -> list<row>, most recent first
+        self._byTour = dict()     # tour ID -> list<row>, in file order
+        self._playerIDs = dict()  # lower-case player name -> set of IDs
+        self.columns = list()
+        self.mtime = None
+
+    def load(self):
+        self.mtime = os.stat(self._fname).st_mtime
+        reader = AugmentedGamesfileReader(self._fname)
+        reader.load()
+        self.columns = reader.getHeader().split(",")
+        keyCol, dateCol = reader.col("MatchKey"), reader.col("Date")
+        wNameCol, lNameCol = reader.col("WName"), reader.col("LName")
+        self._rows = reader.rows()
+        for row in self._rows:
+            winnerID, loserID, tourID, roundID = row[keyCol].split("/")
+            self._byKey[row[keyCol]] = row
+            self._byTour.setdefault(tourID, list()).append(row)
+            for playerID, nameCol in ((winnerID, wNameCol),
+                                      (loserID, lNameCol)):
+                self._byPlayer.setdefault(playerID, list()).append(row)
+                self._playerIDs.setdefault(row[nameCol].lower(),
+                                           set()).add(playerID)
+        for playerRows in self._byPlayer.itervalues():
+            playerRows.sort(key=lambda row: ymdToOrdinal(row[dateCol]),
+                            reverse=True)
+
+    def getMatch(self, matchKey):
+        row = self._byKey.get(matchKey)
+        return [row] if row else []
+
+    def getLastMatches(self, playerID, n):
+        return self._byPlayer.get(playerID, [])[:n]
+
+    def getPlayerIDs(self, name):
+        return self._playerIDs.get(name.lower(), set())
+
+    def getTournament(self, tourID):
+        return self._byTour.get(tourID, [])
+
+
+class MatchLookupService(object):
+    '''
+    Answers queries (see the notes up top) off a MatchIndex per gender,
+    reloading them as their files change:
+     - Create one with a map of gender -> augmented file
+     - Call load()
+     - Call startReloader(), then query() away
+    '''
+    def __init__(self, files, cacheSize=CACHE_SIZE):
+        self._files = files
+        self._cacheSize = cacheSize
+        # (map of gender -> MatchIndex, LRUCache) - always swapped as a pair
+        self._state = (dict(), LRUCache(cacheSize))
+        self._lastSeen = dict() # gender -> (mtime, size) seen at last poll
+
+    def load(self, genders=None):
+        '''
+        (Re)loads the files of the given genders (all by default)
+        '''
+        indexes = dict(self._state[0])
+        for gender in (genders or self._files.keys()):
+            if DEBUG: print "MatchLookupService: Loading %s" % (
+                                                       self._files[gender])
+            index = MatchIndex(gender, self._files[gender])
+            index.load()
+            indexes[gender] = index
+        self._state = (indexes, LRUCache(self._cacheSize))
+
+    def _changedGenders(self):
+        changed = list()
+        for gender, fname in self._files.iteritems():
+            try:
+                st = os.stat(fname)
+            except OSError:
+                continue # being rewritten, we'll catch it next time
+            seen = (st.st_mtime, st.st_size)
+            stable = self._lastSeen.get(gender) == seen
+            self._lastSeen[gender] = seen
+            if stable and st.st_mtime != self._state[0][gender].mtime:
+                changed.append(gender)
+        return changed
+
+    def startReloader(self, pollSeconds=RELOAD_POLL_SECONDS):
+        def poll():
+            while True:
+                changed = self._changedGenders()
+                if changed:
+                    try:
+                        self.load(changed)
+                    except Exception as e:
+                        print "WARNING: Reload of %s failed: %s" % (changed, e)
+                time.sleep(pollSeconds)
+        thread = threading.Thread(target=poll)
+        thread.daemon = True
+        thread.start()
+
+    def query(self, path, params):
+        '''
+        path is e.g. "/player", params a map of query parameter -> value
+        Returns the JSON response string
+        Raises: ValueError for bad queries
+        '''
+        indexes, cache = self._state
+        cacheKey = (path, tuple(sorted(params.iteritems())))
+        response = cache.get(cacheKey)
+        if response is not None:
+            return response
+
+        gender = params.get("gender")
+        if gender and gender not in indexes:
+            raise ValueError("Unknown gender %s" % gender)
+        if not gender and "id" in params and path in ("/player",
+                                                      "/tournament"):
+            raise ValueError("Missing parameter gender, needed with id")
+        targets = [indexes[gender]] if gender else [
+                                         indexes[g] for g in sorted(indexes)]
+        rows = list()
+        for index in targets:
+            if path == "/match":
+                found = index.getMatch(self._required(params, "key"))
+            elif path == "/player":
+                n = int(params.get("n", DEFAULT_LAST_MATCHES))
+                if n < 1:
+                    raise ValueError("Bad parameter n %s" % n)
+                if "id" in params:
+                    playerIDs = [params["id"]]
+                else:
+                    playerIDs = index.getPlayerIDs(
+                                           self._required(params, "name"))
+                found = list()
+                for playerID in playerIDs:
+                    found.extend(index.getLastMatches(playerID, n))
+            elif path == "/tournament":
+                found = index.getTournament(self._required(params, "id"))
+            else:
+                raise ValueError("Unknown query %s" % path)
+            rows.extend([field.decode(TEXT_ENCODING, "replace")
+                         for field in row] + [index.gender] for row in found)
+
+        columns = (targets[0].columns if targets else []) + ["Gender"]
+        response = json.dumps({"columns": columns, "rows": rows})
+        cache.put(cacheKey, response)
+        return response
+
+    def _required(self, params, name):
+        if name not in params:
+            raise ValueError("Missing parameter %s" % name)
+        return params[name]
+
+
+class MatchLookupHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # so clients can keep connections open
+    # send each response in one go, else kept-alive connections stall on
+    # delayed ACKs for ~40ms a request
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    service = None                # set by doMain()
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        params = dict((k, v[-1]) for k, v in
+                      urlparse.parse_qs(url.query).iteritems())
+        try:
+            status, body = 200, self.service.query(url.path, params)
+        except ValueError as e:
+            status, body = 400, json.dumps({"error": str(e)})
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # far too chatty under load
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                          BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def doMain():
+    genderCodes = ["atp", # men's
+                   "wta"] # women's
+    csvDir = "/home/mzc/dev/tennis/oncourt/data/csv" # augmented files dir
+    if len(sys.argv) > 1:
+        csvDir = sys.argv[1]
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else PORT
+    augment_games_data.DEBUG = DEBUG
+
+    service = MatchLookupService(dict(
+            (gender, "%s/augmented_games_%s.csv" % (csvDir, gender))
+            for gender in genderCodes))
+    service.load()
+    service.startReloader()
+    MatchLookupHandler.service = service
+    server = ThreadingHTTPServer((HOST, port), MatchLookupHandler)
+    print "MatchLookupService: Serving on http://%s:%s" % (HOST, port)
+    server.serve_forever()
+    return 0
+
+if __name__ == "__main__":
+   doMain()
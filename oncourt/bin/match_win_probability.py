@@ -0,0 +1,321 @@
+#!/home/mzc/anaconda2/bin/python
+
+'''
+Program to add Markov-chain match win probabilities to the augmented games
+files written by augment_games_data.py
+
+Notes:
+ - this is the classic point -> game -> set -> match model: each player wins
+   points on their own serve with a fixed probability, estimated from the
+   match stats as (firstSvPtsWon + secondSvPtsWon) / firstSvTot. If a
+   player has no serve points recorded we fall back to 1 - the opponent's
+   recvPtsWon / recvPtsTot
+
+ - games are closed-form, tie-breaks / sets / matches are DPs over the score
+   which keep track of who serves, including which player serves first in
+   the next set. All sets are assumed to finish with a tie-break at 6-6
+
+ - we don't know who served first in a match, so we average over both
+
+ - the DPs are only ever run on a quantized grid of serve-win probabilities
+   (see GRID_STEPS) and memoized, so the whole program does at most a few
+   tens of thousands of them however many matches there are. The grid is a
+   numpy array per best-of, filled in for just the cells the matches need.
+   Per-match probabilities are then bilinearly interpolated off it for all
+   matches at once, with array indexing
+
+ - best-of-5 is inferred when the winner won 3 sets or 4+ sets were played,
+   otherwise we assume best-of-3 (so a best-of-5 retirement at 2-1 counts as
+   best-of-3)
+
+ - we write a copy of the augmented file with these columns added:
+   WSvPtsWonPct, LSvPtsWonPct, BestOf, WMatchWinProb. They're 'n/a' for
+   matches without (or with unusable) stats
+'''
+
+import sys
+
+import numpy as np
+
+import augment_games_data
+from augment_games_data import AugmentedGamesfileReader
+
+GRID_STEPS = 100 # serve-win probabilities are tabulated in steps of 1/100
+
+DEBUG = True
+
+
+def gameWinProb(p):
+    '''
+    Probability the server wins a game, winning each point with probability p
+    '''
+    q = 1.0 - p
+    if p == 0.0:
+        return 0.0
+    # to love, 15 or 30, or via deuce (reached with prob 20.p^3.q^3)
+    return (p**4 * (1 + 4*q + 10*q*q) +
+            20 * p**3 * q**3 * p*p / (p*p + q*q))
+
+
+def tieBreakWinProb(pa, pb):
+    '''
+    Probability A wins a tie-break which A serves first, where A/B win points
+    on their own serve with probability pa/pb
+    '''
+    # A serves point 0, then each player serves 2 points at a time, so from
+    # 6-6 on every pair of points has one point served by each player
+    winPair = pa * (1 - pb)
+    losePair = (1 - pa) * pb
+    fromDeuce = (winPair / (winPair + losePair) if winPair + losePair
+                 else 0.5)
+    result = 0.0
+    reach = {(0, 0): 1.0}
+    for n in xrange(12): # 12 points take us to 6-6 at the latest
+        nextReach = dict()
+        aServes = n == 0 or ((n - 1) // 2) % 2 == 1
+        pw = pa if aServes else 1 - pb
+        for (a, b), prob in reach.iteritems():
+            for (na, nb), pp in (((a + 1, b), pw), ((a, b + 1), 1 - pw)):
+                if na == 7:
+                    result += prob * pp
+                elif nb == 7:
+                    pass
+                else:
+                    nextReach[(na, nb)] = nextReach.get((na, nb), 0.0) + \
+                                          prob * pp
+        reach = nextReach
+    return result + reach.get((6, 6), 0.0) * fromDeuce
+
+
+def setOutcomes(ga, gb, tb):
+    '''
+    ga/gb are the probabilities A/B hold serve, tb the probability A wins a
+    tie-break A serves first. A serves the first game of the set.
+    Returns (P(A wins, A serves first next set), P(A wins, B does),
+             P(B wins, A serves first next set), P(B wins, B does))
+    '''
+    outcomes = [0.0, 0.0, 0.0, 0.0]
+    reach = {(0, 0): 1.0}
+    while reach:
+        nextReach = dict()
+        for (a, b), prob in reach.iteritems():
+            played = a + b
+            if a == 6 and b == 6:
+                # 13 games in the set, so B serves first next set
+                outcomes[1] += prob * tb
+                outcomes[3] += prob * (1 - tb)
+                continue
+            pw = ga if played % 2 == 0 else 1 - gb
+            # the game after this one is game number played + 2, so A
+            # serves first next set if that's an odd number
+            aNext = 0 if played % 2 == 1 else 1
+            for (na, nb), pp, aWon in (((a + 1, b), pw, True),
+                                       ((a, b + 1), 1 - pw, False)):
+                if ((na >= 6 and na - nb >= 2) or na == 7 or
+                    (nb >= 6 and nb - na >= 2) or nb == 7):
+                    outcomes[(0 if aWon else 2) + aNext] += prob * pp
+                else:
+                    nextReach[(na, nb)] = nextReach.get((na, nb), 0.0) + \
+                                          prob * pp
+        reach = nextReach
+    return outcomes
+
+
+class MatchWinProbabilityTable(object):
+    '''
+    Memoized match win probabilities on a grid of serve-win probabilities:
+    entry (i, j) is for A winning points on serve with probability
+    i/GRID_STEPS and B with j/GRID_STEPS. Use getMatchWinProbs() to look up
+    (and interpolate) arrays of arbitrary probabilities, or tabulate() to
+    fill the whole grid up front
+    '''
+    def __init__(self, gridSteps=GRID_STEPS):
+        self._steps = gridSteps
+        self._games = dict()    # i -> P(hold serve)
+        self._sets = dict()     # (i, j) -> setOutcomes() with A serving first
+        self._matches = dict()  # (i, j, bestOf) -> P(A wins match)
+        self._grids = dict()    # bestOf -> array of P(A wins match), nan
+                                # where not worked out yet
+
+    def _hold(self, i):
+        if i not in self._games:
+            self._games[i] = gameWinProb(float(i) / self._steps)
+        return self._games[i]
+
+    def _set(self, i, j):
+        if (i, j) not in self._sets:
+            pa, pb = float(i) / self._steps, float(j) / self._steps
+            self._sets[(i, j)] = setOutcomes(self._hold(i), self._hold(j),
+                                             tieBreakWinProb(pa, pb))
+        return self._sets[(i, j)]
+
+    def _matchOnGrid(self, i, j, bestOf):
+        key = (i, j, bestOf)
+        if key in self._matches:
+            return self._matches[key]
+
+        toWin = bestOf // 2 + 1
+        aFirst = self._set(i, j)
+        # B serving first is A serving first with the roles swapped, which
+        # puts the outcomes in reverse order from A's point of view
+        bFirst = tuple(reversed(self._set(j, i)))
+        result = 0.0
+        for startA in (True, False): # we don't know who served first
+            # map of (A sets, B sets, A serves first) -> probability
+            reach = {(0, 0, startA): 0.5}
+            while reach:
+                nextReach = dict()
+                for (a, b, aServes), prob in reach.iteritems():
+                    outcomes = aFirst if aServes else bFirst
+                    for k, (na, nb) in enumerate(((a + 1, b), (a + 1, b),
+                                                  (a, b + 1), (a, b + 1))):
+                        pp = prob * outcomes[k]
+                        if na == toWin:
+                            result += pp
+                        elif nb < toWin:
+                            state = (na, nb, k % 2 == 0)
+                            nextReach[state] = nextReach.get(state, 0.0) + pp
+                reach = nextReach
+        self._matches[key] = result
+        return result
+
+    def _getGrid(self, bestOf, i, j):
+        '''
+        Returns the grid for bestOf, with cells (i, j) filled in (i and j
+        are arrays of grid indices)
+        '''
+        if bestOf not in self._grids:
+            self._grids[bestOf] = np.full((self._steps + 1, self._steps + 1),
+                                          np.nan)
+        grid = self._grids[bestOf]
+        missing = np.isnan(grid[i, j])
+        for ii, jj in set(zip(i[missing], j[missing])):
+            grid[ii, jj] = self._matchOnGrid(ii, jj, bestOf)
+        return grid
+
+    def tabulate(self, bestOfs=(3, 5)):
+        cells = np.arange(self._steps + 1)
+        i, j = [a.ravel() for a in np.meshgrid(cells, cells)]
+        for bestOf in bestOfs:
+            self._getGrid(bestOf, i, j)
+
+    def getMatchWinProbs(self, pa, pb, bestOf):
+        '''
+        Probabilities A wins a best-of-bestOf match where A/B win points on
+        their own serve with probabilities pa/pb (arrays, or numbers),
+        interpolated off the grid
+        '''
+        x = np.asarray(pa, dtype=float) * self._steps
+        y = np.asarray(pb, dtype=float) * self._steps
+        i = np.minimum(x.astype(int), self._steps - 1)
+        j = np.minimum(y.astype(int), self._steps - 1)
+        fx, fy = x - i, y - j
+        corners = (np.concatenate([i.ravel(), i.ravel() + 1] * 2),
+                   np.concatenate([j.ravel()] * 2 + [j.ravel() + 1] * 2))
+        grid = self._getGrid(bestOf, *corners)
+        return ((1 - fx) * (1 - fy) * grid[i, j] +
+                fx * (1 - fy) * grid[i + 1, j] +
+                (1 - fx) * fy * grid[i, j + 1] +
+                fx * fy * grid[i + 1, j + 1])
+
+    def getMatchWinProb(self, pa, pb, bestOf):
+        '''
+        getMatchWinProbs() for a single match
+        '''
+        return float(self.getMatchWinProbs(pa, pb, bestOf))
+
+
+class MatchWinProbabilityAdder(object):
+    '''
+    Adds the win probability columns to an augmented games file:
+     - Create one with a MatchWinProbabilityTable
+     - Call load() with an AugmentedGamesfileReader that's been loaded
+     - Call dump()
+    '''
+    HEADER = "WSvPtsWonPct,LSvPtsWonPct,BestOf,WMatchWinProb"
+
+    def __init__(self, table):
+        self._table = table
+        self._header = None
+        self._rows = list() # list<str> of full output rows
+
+    def _servePtsWonPct(self, reader, row, me, opp):
+        '''
+        Returns None if there's nothing usable in the stats
+        '''
+        svTot = float(row[reader.col("%sfirstSvTot" % me)])
+        if svTot > 0:
+            p = (float(row[reader.col("%sfirstSvPtsWon" % me)]) +
+                 float(row[reader.col("%ssecondSvPtsWon" % me)])) / svTot
+        else:
+            recvTot = float(row[reader.col("%srecvPtsTot" % opp)])
+            if recvTot <= 0:
+                return None
+            p = 1 - float(row[reader.col("%srecvPtsWon" % opp)]) / recvTot
+        return p if 0.0 <= p <= 1.0 else None
+
+    def load(self, reader):
+        self._header = "%s,%s" % (reader.getHeader(), self.HEADER)
+        wSetsCol, lSetsCol = reader.col("WSets"), reader.col("LSets")
+        rows, bestOfs, pws, pls = list(), list(), list(), list()
+        for row in reader.rows():
+            wSets, lSets = int(row[wSetsCol]), int(row[lSetsCol])
+            bestOfs.append(5 if wSets >= 3 or wSets + lSets >= 4 else 3)
+            pw = pl = None
+            if reader.hasStats(row):
+                pw = self._servePtsWonPct(reader, row, "W", "L")
+                pl = self._servePtsWonPct(reader, row, "L", "W")
+            if pw is None or pl is None:
+                pw = pl = np.nan
+            rows.append(row)
+            pws.append(pw)
+            pls.append(pl)
+
+        # all the matches of a best-of are interpolated in one go
+        bestOfs, pws, pls = np.array(bestOfs), np.array(pws), np.array(pls)
+        probs = np.full(len(rows), np.nan)
+        usable = ~np.isnan(pws)
+        for bestOf in np.unique(bestOfs[usable]):
+            these = usable & (bestOfs == bestOf)
+            probs[these] = self._table.getMatchWinProbs(pws[these],
+                                                        pls[these], bestOf)
+        for k, row in enumerate(rows):
+            if usable[k]:
+                extra = ["%.4f" % pws[k], "%.4f" % pls[k], str(bestOfs[k]),
+                         "%.4f" % probs[k]]
+            else:
+                extra = ["n/a", "n/a", str(bestOfs[k]), "n/a"]
+            self._rows.append(",".join(row + extra))
+
+        if DEBUG: print "MatchWinProbabilityAdder: %s matches, %s grid DPs" % (
+                                len(self._rows), len(self._table._matches))
+
+    def dump(self, destPath):
+        if DEBUG: print "MatchWinProbabilityAdder: Dumping to %s" % destPath
+        with open(destPath, "wb") as outfile:
+            outfile.write("%s\n" % self._header)
+            outfile.write("\n".join(self._rows))
+            outfile.write("\n")
+
+
+def doMain():
+    genderCodes = ["atp", # men's
+                   "wta"] # women's
+    csvDir = "/home/mzc/dev/tennis/oncourt/data/csv" # augmented files dir
+    if len(sys.argv) > 1:
+        csvDir = sys.argv[1]
+    augment_games_data.DEBUG = DEBUG
+
+    table = MatchWinProbabilityTable() # shared, it's gender-neutral
+    for gender in genderCodes:
+        fname = "%s/augmented_games_%s.csv" % (csvDir, gender)
+        reader = AugmentedGamesfileReader(fname)
+        reader.load()
+        adder = MatchWinProbabilityAdder(table)
+        adder.load(reader)
+        adder.dump("%s/augmented_games_winprob_%s.csv" % (csvDir, gender))
+
+    return 0
+
+if __name__ == "__main__":
+   doMain()
@@ -0,0 +1,147 @@
+#!/home/mzc/anaconda2/bin/python
+
+'''
+Program to time PlayerMapper's name search index (see PlayerNameIndex in
+augment_games_data.py) on the ATP and WTA players files together
+
+Notes:
+ - we time building the index, save()/restore() of the mapper, and
+   autocomplete() / search() queries made from real names: prefixes of
+   surnames, "surname initial" forms, and names with a typo (a letter
+   swapped, dropped or doubled, as people type them). For comparison, a
+   few queries are also timed against a scan of every name form, which is
+   what finding a player cost before the index
+
+ - queries are drawn with a fixed seed, so runs are comparable
+
+ - usage: player_name_search_benchmark.py [raw csv dir] [queries]
+'''
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+import augment_games_data
+from augment_games_data import (PlayerMapper, PlayerNameIndex, foldName,
+                                initialForms, nameForms, trigrams)
+
+DEFAULT_QUERIES = 2000
+SCANNED = 20 # queries timed without the index, which takes a while
+SEED = 12345
+
+DEBUG = True
+
+
+def makeQueries(names, nQueries, rng):
+    '''
+    Returns (list<autocomplete prefix>, list<fuzzy query>)
+    '''
+    prefixes, fuzzy = list(), list()
+    for name in rng.sample(names, min(nQueries, len(names))):
+        folded = foldName(name)
+        tokens = folded.split()
+        surname = tokens[-1]
+        prefixes.append(surname[:rng.randint(2, max(2, len(surname)))])
+        if len(tokens) > 1 and rng.random() < 0.5:
+            fuzzy.append("%s %s" % (surname, tokens[0][0]))
+            continue
+        i = rng.randrange(len(folded))
+        edit = rng.randrange(3)
+        if edit == 0 and i + 1 < len(folded):
+            folded = folded[:i] + folded[i + 1] + folded[i] + folded[i + 2:]
+        elif edit == 1:
+            folded = folded[:i] + folded[i + 1:]
+        else:
+            folded = folded[:i] + folded[i] + folded[i:]
+        fuzzy.append(folded)
+    return prefixes, fuzzy
+
+
+def timeQueries(func, queries):
+    '''
+    Returns microseconds per query as (mean, median, 99th percentile)
+    '''
+    times = list()
+    for query in queries:
+        start = time.time()
+        func(query)
+        times.append((time.time() - start) * 1e6)
+    times.sort()
+    return (sum(times) / len(times), times[len(times) // 2],
+            times[min(len(times) - 1, int(len(times) * 0.99))])
+
+
+def report(label, timings):
+    print "%-32s mean %9.1fus  median %9.1fus  p99 %9.1fus" % (
+                                                         (label,) + timings)
+
+
+def doMain():
+    genderCodes = ["atp", # men's
+                   "wta"] # women's
+    rawCsvDir = "/home/mzc/dev/tennis/oncourt/data/rawcsv" # raw data dir
+    if len(sys.argv) > 1:
+        rawCsvDir = sys.argv[1]
+    nQueries = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_QUERIES
+    augment_games_data.DEBUG = False
+    rng = random.Random(SEED)
+
+    mappers, names = list(), list()
+    start = time.time()
+    for gender in genderCodes:
+        playerMapper = PlayerMapper(gender, rawCsvDir, "ID_P", "NAME_P",
+                                    "DATE_P")
+        playerMapper.load()
+        mappers.append(playerMapper)
+        # leave out doubles pairs and names with nothing to search on
+        names.extend(name for name in playerMapper._map.itervalues()
+                     if "/" not in name and foldName(name))
+    print "Loaded and indexed %s players in %.2fs" % (len(names),
+                                                      time.time() - start)
+
+    fd, savePath = tempfile.mkstemp(suffix=".pickle")
+    os.close(fd)
+    try:
+        start = time.time()
+        mappers[0].save(savePath)
+        saved = time.time() - start
+        restored = PlayerMapper(genderCodes[0], rawCsvDir, "ID_P", "NAME_P",
+                                "DATE_P")
+        start = time.time()
+        restored.restore(savePath)
+        print "%s mapper: save %.2fs, restore %.2fs (%s bytes)" % (
+            genderCodes[0], saved, time.time() - start,
+            os.path.getsize(savePath))
+    finally:
+        os.remove(savePath)
+
+    prefixes, fuzzy = makeQueries(names, nQueries, rng)
+    report("autocomplete", timeQueries(
+        lambda q: [m.autocomplete(q) for m in mappers], prefixes))
+    report("search", timeQueries(
+        lambda q: [m.search(q) for m in mappers], fuzzy))
+
+    # what it costs without the index: a pass over every name form
+    allForms = list()
+    for name in names:
+        folded = foldName(name)
+        allForms.extend((form, trigrams(form), name)
+                        for form in nameForms(folded))
+        allForms.extend((form, None, name) for form in initialForms(folded))
+    report("autocomplete (scan)", timeQueries(
+        lambda q: [name for form, grams, name in allForms
+                   if form.startswith(q)],
+        [foldName(q) for q in rng.sample(prefixes, min(SCANNED,
+                                                       len(prefixes)))]))
+    report("search (scan)", timeQueries(
+        lambda q: [name for form, grams, name in allForms if grams and
+                   2.0 * len(q & grams) / (len(q) + len(grams)) >=
+                   PlayerNameIndex.MIN_SCORE],
+        [trigrams(foldName(q)) for q in rng.sample(fuzzy, min(SCANNED,
+                                                             len(fuzzy)))]))
+    return 0
+
+if __name__ == "__main__":
+   sys.exit(doMain())
@@ -0,0 +1,374 @@
+#!/home/mzc/anaconda2/bin/python
+
+'''
+Program to find the players who play most like a given player, on a given
+surface (or on all of them), from the augmented games files written by
+augment_games_data.py
+
+Notes:
+ - each player gets a style vector per surface: the FEATURES below (serve
+   percentages, aces and double faults per serve point, net approaches,
+   winners and unforced errors per point, serve speeds...), worked out from
+   the sums of their stats over every match with stats on that surface.
+   Players with fewer than MIN_MATCHES such matches are left out
+
+ - lots of matches only have some stats recorded (no net approaches, or no
+   serve speeds, say), so each group of stats is only summed over the
+   matches where it was recorded. Features we've nothing for are filled in
+   with the average player's
+
+ - features are z-scored across the players of the surface, then vectors
+   are scaled to unit length, so a vector product is the cosine similarity.
+   Top-k queries are a matrix product of a batch of query vectors with all
+   the vectors plus an argpartition per query (see QUERY_BATCH)
+
+ - the per-player sums, the MatchKeys they came from and the vectors are
+   cached on disk (see StyleProfiles.save()). Next time round only matches
+   we haven't seen get added in, and the vectors are only worked out again
+   if there were any. If matches already in there have since been corrected
+   (see diff_oncourt_exports.py), delete the cache to rebuild it. The cache
+   records the gender and augmented file it was built from (player IDs are
+   only unique within a gender), and gets rebuilt if they don't match
+
+ - usage: player_similarity.py <augmented csv dir> <gender> <cache file>
+                               <surface|all> <player name or ID> [k]
+'''
+
+import os
+import sys
+
+import numpy as np
+
+import augment_games_data
+from augment_games_data import AugmentedGamesfileReader
+
+MIN_MATCHES = 10
+DEFAULT_K = 10
+QUERY_BATCH = 256 # query vectors per matrix product
+ALL_SURFACES = "all"
+
+DEBUG = True
+
+# Per-match quantities we keep sums of, from one player's perspective
+MATCHES, SV_PTS, FIRST_SV_IN, FIRST_SV_PTS_WON, SECOND_SVS, \
+    SECOND_SV_PTS_WON, ACES, DOUBLE_FAULTS, RECV_PTS, RECV_PTS_WON, \
+    NET_PTS, NET_APPROACHES, NET_APPROACHES_WON, RALLY_PTS, WINNERS, \
+    UNFORCED_ERRS, KPH_MATCHES, FASTEST_KPH, FIRST_SV_KPH, \
+    SECOND_SV_KPH = range(20)
+N_QUANTITIES = 20
+
+# (feature name, numerator, denominator) - all features are ratios of sums
+FEATURES = (("FirstSvPct",        FIRST_SV_IN,        SV_PTS),
+            ("FirstSvWonPct",     FIRST_SV_PTS_WON,   FIRST_SV_IN),
+            ("SecondSvWonPct",    SECOND_SV_PTS_WON,  SECOND_SVS),
+            ("AcesPerSvPt",       ACES,               SV_PTS),
+            ("DfsPerSvPt",        DOUBLE_FAULTS,      SV_PTS),
+            ("RecvPtsWonPct",     RECV_PTS_WON,       RECV_PTS),
+            ("NetApproachesPerPt", NET_APPROACHES,    NET_PTS),
+            ("NetWonPct",         NET_APPROACHES_WON, NET_APPROACHES),
+            ("WinnersPerPt",      WINNERS,            RALLY_PTS),
+            ("UnforcedErrsPerPt", UNFORCED_ERRS,      RALLY_PTS),
+            ("FastestSvKph",      FASTEST_KPH,        KPH_MATCHES),
+            ("FirstSvKph",        FIRST_SV_KPH,       KPH_MATCHES),
+            ("SecondSvKph",       SECOND_SV_KPH,      KPH_MATCHES))
+
+
+def styleVectors(sums):
+    '''
+    sums is an array (players, N_QUANTITIES). Returns array (players,
+    features) of z-scored, unit-length style vectors
+    '''
+    num = sums[:, [f[1] for f in FEATURES]]
+    den = sums[:, [f[2] for f in FEATURES]]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ratios = np.where(den > 0, num / den, np.nan)
+        mean, std = np.nanmean(ratios, axis=0), np.nanstd(ratios, axis=0)
+        z = (ratios - mean) / np.where(std > 0, std, np.nan)
+    z[np.isnan(z)] = 0.0 # i.e. the average player
+    lengths = np.sqrt((z * z).sum(axis=1))
+    return z / np.where(lengths > 0, lengths, 1.0)[:, None]
+
+
+class StyleProfiles(object):
+    '''
+    Per player and surface stat sums, and the style vectors made from them:
+     - Create one for a gender and augmented file, or read() one that was
+       saved
+     - Call add() with an AugmentedGamesfileReader that's been loaded
+     - Call getIndex() for a surface
+     - Call save() if add() added anything
+    '''
+    STATS_COLS = ("firstSvIn", "firstSvTot", "aces", "doubleFaults",
+                  "unforcedErrs", "firstSvPtsWon", "secondSvPtsWon",
+                  "winners", "recvPtsWon", "recvPtsTot", "netApproachWon",
+                  "netApproachTot", "fastestServeKph", "avgFirstSvKph",
+                  "avgSecondSvKph")
+
+    def __init__(self, gender, source):
+        self.gender = gender
+        self.source = source      # absolute path of the augmented file
+        self._rows = dict()       # (player ID, surface) -> row of _sums
+        self._keys = list()       # row -> (player ID, surface)
+        self._sums = np.zeros((0, N_QUANTITIES))
+        self._seen = set()        # MatchKeys already summed up
+        self._names = dict()      # player ID -> name
+        self._vectors = dict()    # surface -> (player IDs, style vectors)
+
+    def _quantities(self, reader, row, me):
+        s = dict((colName, float(row[reader.col(me + colName)]))
+                 for colName in self.STATS_COLS)
+        q = np.zeros(N_QUANTITIES)
+        q[MATCHES] = 1
+        q[SV_PTS] = s["firstSvTot"]
+        q[FIRST_SV_IN] = s["firstSvIn"]
+        q[FIRST_SV_PTS_WON] = s["firstSvPtsWon"]
+        q[SECOND_SVS] = s["firstSvTot"] - s["firstSvIn"]
+        q[SECOND_SV_PTS_WON] = s["secondSvPtsWon"]
+        q[ACES] = s["aces"]
+        q[DOUBLE_FAULTS] = s["doubleFaults"]
+        q[RECV_PTS] = s["recvPtsTot"]
+        q[RECV_PTS_WON] = s["recvPtsWon"]
+        points = s["firstSvTot"] + s["recvPtsTot"]
+        if s["netApproachTot"] > 0:
+            q[NET_PTS] = points
+            q[NET_APPROACHES] = s["netApproachTot"]
+            q[NET_APPROACHES_WON] = s["netApproachWon"]
+        if s["winners"] + s["unforcedErrs"] > 0:
+            q[RALLY_PTS] = points
+            q[WINNERS] = s["winners"]
+            q[UNFORCED_ERRS] = s["unforcedErrs"]
+        if s["fastestServeKph"] > 0 and s["avgSecondSvKph"] > 0:
+            q[KPH_MATCHES] = 1
+            q[FASTEST_KPH] = s["fastestServeKph"]
+            q[FIRST_SV_KPH] = s["avgFirstSvKph"]
+            q[SECOND_SV_KPH] = s["avgSecondSvKph"]
+        return q
+
+    def add(self, reader):
+        '''
+        Adds in the matches (with stats) of reader we haven't seen before.
+        Returns how many there were
+        '''
+        keyCol, surfaceCol = reader.col("MatchKey"), reader.col("Surface")
+        wNameCol, lNameCol = reader.col("WName"), reader.col("LName")
+        newRows, newSums = list(), list()
+        nAdded = 0
+        for row in reader.rows():
+            matchKey = row[keyCol]
+            if matchKey in self._seen or not reader.hasStats(row):
+                continue
+            self._seen.add(matchKey)
+            winnerID, loserID = [int(x) for x in matchKey.split("/")[0:2]]
+            self._names[winnerID] = row[wNameCol]
+            self._names[loserID] = row[lNameCol]
+            for playerID, me in ((winnerID, "W"), (loserID, "L")):
+                key = (playerID, row[surfaceCol])
+                if key not in self._rows:
+                    self._rows[key] = len(self._keys)
+                    self._keys.append(key)
+                newRows.append(self._rows[key])
+                newSums.append(self._quantities(reader, row, me))
+            nAdded += 1
+
+        if nAdded:
+            sums = np.zeros((len(self._keys), N_QUANTITIES))
+            sums[:len(self._sums)] = self._sums
+            np.add.at(sums, np.array(newRows), np.array(newSums))
+            self._sums = sums
+            self._vectors = dict() # out of date now
+        if DEBUG: print "StyleProfiles: Added %s new matches, %s profiles" % (
+                                                   nAdded, len(self._keys))
+        return nAdded
+
+    def getSurfaces(self):
+        return sorted(set(surface for playerID, surface in self._keys))
+
+    def getName(self, playerID):
+        return self._names.get(playerID, "")
+
+    def getPlayerIDs(self, name):
+        '''
+        Case-insensitive lookup of a name. Returns list<player ID>
+        '''
+        name = name.lower()
+        return [playerID for playerID, playerName in self._names.iteritems()
+                if playerName.lower() == name]
+
+    def _surfaceVectors(self, surface):
+        if surface not in self._vectors:
+            if surface == ALL_SURFACES:
+                playerIDs = sorted(set(p for p, s in self._keys))
+                position = dict((p, i) for i, p in enumerate(playerIDs))
+                sums = np.zeros((len(playerIDs), N_QUANTITIES))
+                np.add.at(sums, [position[p] for p, s in self._keys],
+                          self._sums)
+            else:
+                rows = [i for i, (p, s) in enumerate(self._keys)
+                        if s == surface]
+                playerIDs = [self._keys[i][0] for i in rows]
+                sums = self._sums[rows]
+            enough = sums[:, MATCHES] >= MIN_MATCHES
+            self._vectors[surface] = (
+                    np.array(playerIDs, dtype=np.int32)[enough],
+                    styleVectors(sums[enough]))
+        return self._vectors[surface]
+
+    def getIndex(self, surface):
+        '''
+        Returns a SimilarityIndex of the players of surface (or ALL_SURFACES)
+        '''
+        playerIDs, vectors = self._surfaceVectors(surface)
+        return SimilarityIndex(playerIDs, vectors)
+
+    def save(self, destPath):
+        '''
+        Saves gender, source, sums, MatchKeys, names and the vectors of
+        every surface
+        '''
+        if DEBUG: print "StyleProfiles: Saving to %s" % destPath
+        arrays = dict()
+        for i, surface in enumerate(self.getSurfaces() + [ALL_SURFACES]):
+            playerIDs, vectors = self._surfaceVectors(surface)
+            arrays["surface%s" % i] = np.array(surface)
+            arrays["playerIDs%s" % i] = playerIDs
+            arrays["vectors%s" % i] = vectors
+        names = sorted(self._names.iteritems())
+        # np.savez adds .npz to names without it, so write to a file object
+        with open(destPath, "wb") as f:
+            np.savez(f,
+                     gender=np.array(self.gender),
+                     source=np.array(self.source),
+                     keyPlayerIDs=np.array([p for p, s in self._keys],
+                                           dtype=np.int32),
+                     keySurfaces=np.array([s for p, s in self._keys],
+                                          dtype=str),
+                     sums=self._sums,
+                     seen=np.array(sorted(self._seen), dtype=str),
+                     namePlayerIDs=np.array([p for p, n in names],
+                                            dtype=np.int32),
+                     names=np.array([n for p, n in names], dtype=str),
+                     **arrays)
+
+    @classmethod
+    def read(cls, srcPath):
+        '''
+        gender and source are None for caches saved before we kept them
+        '''
+        data = np.load(srcPath)
+        profiles = cls(*[str(data[name]) if name in data else None
+                         for name in ("gender", "source")])
+        profiles._keys = zip([int(p) for p in data["keyPlayerIDs"]],
+                             [str(s) for s in data["keySurfaces"]])
+        profiles._rows = dict((key, i)
+                              for i, key in enumerate(profiles._keys))
+        profiles._sums = data["sums"]
+        profiles._seen = set(str(k) for k in data["seen"])
+        profiles._names = dict(zip([int(p) for p in data["namePlayerIDs"]],
+                                   [str(n) for n in data["names"]]))
+        i = 0
+        while "surface%s" % i in data:
+            profiles._vectors[str(data["surface%s" % i])] = (
+                    data["playerIDs%s" % i], data["vectors%s" % i])
+            i += 1
+        if DEBUG: print "StyleProfiles: Read %s profiles, %s matches" % (
+                                    len(profiles._keys), len(profiles._seen))
+        return profiles
+
+
+class SimilarityIndex(object):
+    '''
+    Top-k cosine similarity over a matrix of unit-length style vectors
+    '''
+    def __init__(self, playerIDs, vectors):
+        self._playerIDs = playerIDs
+        self._vectors = vectors
+        self._position = dict((p, i) for i, p in enumerate(playerIDs))
+
+    def __len__(self):
+        return len(self._playerIDs)
+
+    def __contains__(self, playerID):
+        return playerID in self._position
+
+    def topKBatch(self, queries, k):
+        '''
+        queries is an array (n, features) of style vectors. Returns arrays
+        (n, k) of row positions and similarities of the k most similar
+        vectors to each query, most similar first
+        '''
+        k = min(k, len(self._vectors))
+        positions = np.zeros((len(queries), k), dtype=np.int64)
+        similarities = np.zeros((len(queries), k))
+        for start in xrange(0, len(queries), QUERY_BATCH):
+            sims = queries[start:start + QUERY_BATCH].dot(self._vectors.T)
+            rowsIdx = np.arange(len(sims))[:, None]
+            # the k best of each row in no particular order, then sort those
+            if k < sims.shape[1]:
+                top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            else:
+                top = np.tile(np.arange(sims.shape[1]), (len(sims), 1))
+            topSims = sims[rowsIdx, top]
+            order = np.argsort(-topSims, axis=1, kind="mergesort")
+            positions[start:start + len(sims)] = top[rowsIdx, order]
+            similarities[start:start + len(sims)] = topSims[rowsIdx, order]
+        return positions, similarities
+
+    def topK(self, playerIDs, k=DEFAULT_K):
+        '''
+        Returns list (per player ID) of list<(player ID, similarity)> of the
+        k players most like them, not counting themselves
+        Raises: KeyError for players not in the index
+        '''
+        queries = self._vectors[[self._position[p] for p in playerIDs]]
+        positions, similarities = self.topKBatch(queries, k + 1)
+        results = list()
+        for playerID, pos, sims in zip(playerIDs, positions, similarities):
+            results.append([(int(self._playerIDs[i]), s)
+                            for i, s in zip(pos, sims)
+                            if self._playerIDs[i] != playerID][:k])
+        return results
+
+
+def doMain():
+    if len(sys.argv) < 6:
+        print ("usage: %s <augmented csv dir> <gender> <cache file> "
+               "<surface|%s> <player name or ID> [k]" % (sys.argv[0],
+                                                          ALL_SURFACES))
+        return 1
+    augment_games_data.DEBUG = DEBUG
+    csvDir, gender, cachePath, surface, player = sys.argv[1:6]
+    k = int(sys.argv[6]) if len(sys.argv) > 6 else DEFAULT_K
+    fname = os.path.abspath("%s/augmented_games_%s.csv" % (csvDir, gender))
+
+    profiles, stale = None, True
+    if os.path.exists(cachePath):
+        profiles = StyleProfiles.read(cachePath)
+        stale = (profiles.gender, profiles.source) != (gender, fname)
+        if stale:
+            print "WARNING: %s was built from %s (%s), rebuilding it" % (
+                                cachePath, profiles.source, profiles.gender)
+    if stale:
+        profiles = StyleProfiles(gender, fname)
+    reader = AugmentedGamesfileReader(fname)
+    reader.load()
+    if profiles.add(reader) or stale:
+        profiles.save(cachePath)
+
+    index = profiles.getIndex(surface)
+    playerIDs = ([int(player)] if player.isdigit() else
+                 profiles.getPlayerIDs(player))
+    playerIDs = [p for p in playerIDs if p in index]
+    if not playerIDs:
+        print "No %s profile for %s (need %s matches with stats)" % (
+                                            surface, player, MIN_MATCHES)
+        return 1
+    for playerID, similar in zip(playerIDs, index.topK(playerIDs, k)):
+        print "Players most like %s (%s) on %s:" % (
+                          profiles.getName(playerID), playerID, surface)
+        for otherID, similarity in similar:
+            print "  %6.3f %s (%s)" % (similarity, profiles.getName(otherID),
+                                       otherID)
+    return 0
+
+if __name__ == "__main__":
+   sys.exit(doMain())
@@ -0,0 +1,302 @@
+#!/home/mzc/anaconda2/bin/python
+
+'''
+Program to build 52-week rolling ranking points tables from the augmented
+games files written by augment_games_data.py, and to look them up as of
+any date
+
+Notes:
+ - points are for the round a player reached at a tournament, see
+   ROUND_POINTS (round names as in the augmented file's Round column), or
+   pass a csv of Round,Points rows (with a Winner row) to use another
+   table. A player's points at a tournament are those of the last round
+   they played there, or the Winner entry if they won the final. Rounds not
+   in the table are worth nothing. We've no tournament categories in our
+   data, so every tournament uses the same table
+
+ - matches are walked once, in date order. Each player keeps a running
+   total, and every time a player does better at a tournament the extra
+   points go onto their total and onto an expiry heap. Points expire
+   EXPIRY_DAYS after the tournament's first match, so advancing to a new
+   date only has to pop what's expired off the top of the heap
+
+ - every Monday we take a snapshot of the table: points from matches
+   played before that Monday and not expired by it. Snapshots are kept in
+   memory as arrays of player IDs / points / tournaments, ordered by points
+   - queries for any date are answered off the latest Monday on or before
+   it, the way official rankings work
+
+ - without a date we dump the top DUMP_TOP of every weekly snapshot to
+   ranking_points_<gender>.csv. With one we print the table as of that date
+
+ - usage: ranking_points.py [augmented files dir] [asOfDate (YYYY/M/D)]
+                            [top N] [round points csv]
+'''
+
+import array
+import bisect
+import csv
+import datetime
+import heapq
+import sys
+
+import augment_games_data
+from augment_games_data import AugmentedGamesfileReader, ymdToOrdinal
+
+WINNER = "Winner" # the points table's entry for winning the final
+FINAL_ROUND = "Final"
+ROUND_POINTS = {"Q-First":   1,
+                "Q-Second":  2,
+                "Q-Third":   4,
+                "First":     5,
+                "Second":   10,
+                "Third":    20,
+                "Fourth":   45,
+                "1/4":      90,
+                "1/2":     180,
+                "Final":   300,
+                WINNER:    500}
+
+EXPIRY_DAYS = 52 * 7
+DUMP_TOP = 1000
+
+DEBUG = True
+
+
+def readRoundPoints(fname):
+    '''
+    Reads Round,Points rows (with a header) into a map of round -> points
+    '''
+    roundPoints = dict()
+    with open(fname, "r") as f:
+        rows = csv.reader(f)
+        rows.next() # skips the header
+        for row in rows:
+            if row:
+                roundPoints[row[0].strip()] = int(row[1])
+    return roundPoints
+
+
+def ordinalToYmd(dateOrdinal):
+    d = datetime.date.fromordinal(dateOrdinal)
+    return "%s/%s/%s" % (d.year, d.month, d.day)
+
+
+def nextMonday(dateOrdinal):
+    '''
+    The first Monday strictly after dateOrdinal (ordinal 1 was a Monday)
+    '''
+    return dateOrdinal + 7 - (dateOrdinal - 1) % 7
+
+
+class RankingPointsEngine(object):
+    '''
+    Keeps the rolling points table and its weekly snapshots:
+     - Create one, with a map of round name -> points (plus WINNER)
+     - Call load() with an AugmentedGamesfileReader that's been loaded, or
+       addMatch() each match yourself in date order
+     - Call finish()
+     - Call getTable() / getPoints() for as-of-date queries, or dump()
+    '''
+    def __init__(self, roundPoints=None):
+        self._roundPoints = roundPoints or ROUND_POINTS
+        self._totals = dict()      # player ID -> points
+        self._tourPoints = dict()  # (player ID, tour ID) -> points
+        self._tourTally = dict()   # player ID -> tournaments with points
+        self._tourExpiry = dict()  # tour ID -> expiry date ordinal
+        # heap of (expiry date ordinal, player ID, tour ID, points)
+        self._expiries = list()
+        self._names = dict()       # player ID -> name
+        self._curDate = None
+        self._nextSnapshot = None  # date ordinal of the next Monday
+        self.unknownRounds = set()
+        # the snapshots: Monday date ordinals, and for each one arrays of
+        # player IDs, points and tournaments in table order
+        self._weeks = list()
+        self._snapshots = list()
+
+    def _advanceTo(self, dateOrdinal):
+        '''
+        Takes snapshots of every Monday up to and including dateOrdinal
+        '''
+        if self._nextSnapshot is None:
+            self._nextSnapshot = nextMonday(dateOrdinal - 1)
+        while self._nextSnapshot <= dateOrdinal:
+            self._expireTo(self._nextSnapshot)
+            self._takeSnapshot(self._nextSnapshot)
+            self._nextSnapshot += 7
+        self._expireTo(dateOrdinal)
+        self._curDate = dateOrdinal
+
+    def _expireTo(self, dateOrdinal):
+        while self._expiries and self._expiries[0][0] <= dateOrdinal:
+            expiry, playerID, tourID, points = heapq.heappop(self._expiries)
+            self._totals[playerID] -= points
+            key = (playerID, tourID)
+            self._tourPoints[key] -= points
+            if not self._tourPoints[key]:
+                del self._tourPoints[key]
+                self._tourTally[playerID] -= 1
+            if not self._totals[playerID]:
+                del self._totals[playerID]
+
+    def _takeSnapshot(self, monday):
+        table = sorted(self._totals.iteritems(),
+                       key=lambda entry: (-entry[1], entry[0]))
+        self._weeks.append(monday)
+        self._snapshots.append(
+                (array.array("i", [playerID for playerID, points in table]),
+                 array.array("i", [points for playerID, points in table]),
+                 array.array("h", [self._tourTally[playerID]
+                                   for playerID, points in table])))
+
+    def _award(self, playerID, tourID, points):
+        key = (playerID, tourID)
+        extra = points - self._tourPoints.get(key, 0)
+        if extra <= 0:
+            return
+        if key not in self._tourPoints:
+            self._tourTally[playerID] = self._tourTally.get(playerID, 0) + 1
+        self._tourPoints[key] = points
+        self._totals[playerID] = self._totals.get(playerID, 0) + extra
+        heapq.heappush(self._expiries,
+                       (self._tourExpiry[tourID], playerID, tourID, extra))
+
+    def addMatch(self, dateOrdinal, matchKey, roundName, winnerName=None,
+                 loserName=None):
+        '''
+        Matches must come in date order
+        '''
+        if self._curDate is not None and dateOrdinal < self._curDate:
+            raise ValueError("Match %s is out of date order" % matchKey)
+        if dateOrdinal != self._curDate:
+            self._advanceTo(dateOrdinal)
+        winnerID, loserID, tourID = [int(x) for x in matchKey.split("/")[0:3]]
+        if tourID not in self._tourExpiry:
+            self._tourExpiry[tourID] = dateOrdinal + EXPIRY_DAYS
+        if winnerName:
+            self._names[winnerID] = winnerName
+        if loserName:
+            self._names[loserID] = loserName
+
+        if roundName not in self._roundPoints:
+            self.unknownRounds.add(roundName)
+        points = self._roundPoints.get(roundName, 0)
+        # the winner is at least as good as this round; they'll get more
+        # when they play the next one
+        self._award(winnerID, tourID, self._roundPoints.get(WINNER, 0)
+                    if roundName == FINAL_ROUND else points)
+        self._award(loserID, tourID, points)
+
+    def load(self, reader):
+        dateCol, keyCol = reader.col("Date"), reader.col("MatchKey")
+        roundCol = reader.col("Round")
+        wNameCol, lNameCol = reader.col("WName"), reader.col("LName")
+        # python's sort is stable, so same-date matches keep their file order
+        byDate = sorted(((ymdToOrdinal(row[dateCol]), row)
+                         for row in reader.rows()), key=lambda x: x[0])
+        for dateOrdinal, row in byDate:
+            self.addMatch(dateOrdinal, row[keyCol], row[roundCol],
+                          row[wNameCol], row[lNameCol])
+
+    def finish(self, untilDateStr=None):
+        '''
+        Takes the snapshot of the Monday after the last match, and of any
+        Mondays after that up to untilDateStr ("YYYY/M/D") so that expiries
+        can be followed past the end of the data
+        '''
+        if self._curDate is not None:
+            until = nextMonday(self._curDate)
+            if untilDateStr:
+                until = max(until, ymdToOrdinal(untilDateStr))
+            self._advanceTo(until)
+        if DEBUG: print "RankingPointsEngine: %s weekly snapshots" % (
+                                                          len(self._weeks))
+        if self.unknownRounds:
+            print "WARNING: No points for rounds %s" % (
+                                          ",".join(sorted(self.unknownRounds)))
+
+    def _snapshotAsOf(self, dateOrdinal):
+        '''
+        Raises: ValueError for dates after the week of the last snapshot
+        '''
+        if self._weeks and dateOrdinal >= self._weeks[-1] + 7:
+            raise ValueError("%s is after the last snapshot (%s)" % (
+                    ordinalToYmd(dateOrdinal), ordinalToYmd(self._weeks[-1])))
+        i = bisect.bisect_right(self._weeks, dateOrdinal) - 1
+        return (self._weeks[i], self._snapshots[i]) if i >= 0 else (None,
+                                                                    None)
+
+    def getTable(self, dateStr, top=None):
+        '''
+        Returns (Monday of the snapshot used as "YYYY/M/D", list<(rank,
+        player ID, name, points, tournaments)>) as of dateStr ("YYYY/M/D").
+        The list's empty (and the Monday None) before the first snapshot.
+        Raises: ValueError for dates after the week of the last snapshot
+        '''
+        monday, snapshot = self._snapshotAsOf(ymdToOrdinal(dateStr))
+        if snapshot is None:
+            return None, []
+        playerIDs, points, tours = snapshot
+        n = len(playerIDs) if top is None else min(top, len(playerIDs))
+        return (ordinalToYmd(monday),
+                [(i + 1, playerIDs[i], self._names.get(playerIDs[i], ""),
+                  points[i], tours[i]) for i in xrange(n)])
+
+    def getPoints(self, playerID, dateStr):
+        '''
+        Returns player's points as of dateStr, 0 if they had none
+        '''
+        monday, snapshot = self._snapshotAsOf(ymdToOrdinal(dateStr))
+        if snapshot is None:
+            return 0
+        playerIDs, points, tours = snapshot
+        playerID = int(playerID)
+        for i in xrange(len(playerIDs)):
+            if playerIDs[i] == playerID:
+                return points[i]
+        return 0
+
+    def dump(self, destPath, top=DUMP_TOP):
+        if DEBUG: print "RankingPointsEngine: Dumping to %s" % destPath
+        with open(destPath, "wb") as outfile:
+            writer = csv.writer(outfile, lineterminator="\n")
+            writer.writerow(["Week", "Rank", "PlayerID", "Player", "Points",
+                             "Tournaments"])
+            for monday in self._weeks:
+                week, table = self.getTable(ordinalToYmd(monday), top)
+                writer.writerows([week] + list(entry) for entry in table)
+
+
+def doMain():
+    genderCodes = ["atp", # men's
+                   "wta"] # women's
+    csvDir = "/home/mzc/dev/tennis/oncourt/data/csv" # augmented files dir
+    if len(sys.argv) > 1:
+        csvDir = sys.argv[1]
+    asOfDate = sys.argv[2] if len(sys.argv) > 2 else None
+    top = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    roundPoints = None
+    if len(sys.argv) > 4:
+        roundPoints = readRoundPoints(sys.argv[4])
+    augment_games_data.DEBUG = DEBUG
+
+    for gender in genderCodes:
+        reader = AugmentedGamesfileReader("%s/augmented_games_%s.csv" % (
+                                                             csvDir, gender))
+        reader.load()
+        engine = RankingPointsEngine(roundPoints)
+        engine.load(reader)
+        engine.finish(asOfDate) # lets us ask about dates past the data
+        if asOfDate is None:
+            engine.dump("%s/ranking_points_%s.csv" % (csvDir, gender))
+            continue
+        monday, table = engine.getTable(asOfDate, top)
+        print "%s points as of %s (week of %s)" % (gender, asOfDate, monday)
+        for rank, playerID, name, points, tours in table:
+            print "%5s %-30s %6s %3s" % (rank, name, points, tours)
+
+    return 0
+
+if __name__ == "__main__":
+   doMain()
@@ -0,0 +1,226 @@
+#!/home/mzc/anaconda2/bin/python
+
+'''
+Program to simulate a tournament draw many times over and report each
+player's probability of reaching each round
+
+Notes:
+ - the draw is rebuilt from an augmented games file written by
+   augment_games_data.py: given a tour ID and the round ID of its first
+   main-draw round, we take the matches of that round and every later one
+   and work the bracket out from who went on to play whom. Players who
+   first appear after the first round had byes. This relies on OnCourt
+   round IDs going up as a tournament goes on
+
+ - win probabilities for every possible matchup come from whichever model
+   you like, as an n x n matrix (see MatchupModel). From the command line
+   they're read from a csv of PlayerA,PlayerB,ProbAWins rows (player names
+   as in the augmented file); any matchup not in there is a coin-toss
+
+ - simulations are vectorized with numpy: each round of each chunk of
+   CHUNK_SIMS simulations is a couple of array operations over the whole
+   chunk. Chunks are farmed out to a process pool, each with its own RNG
+   seeded from (seed, chunk number), so results only depend on the seed and
+   the number of simulations - not on how many processes ran them
+
+ - usage: simulate_draw.py <augmented file> <tourID> <first round ID>
+                           [matchup probs csv] [simulations] [seed]
+'''
+
+import csv
+import multiprocessing
+import sys
+
+import numpy as np
+
+import augment_games_data
+from augment_games_data import AugmentedGamesfileReader
+
+CHUNK_SIMS = 100000
+DEFAULT_SIMS = 1000000
+DEFAULT_SEED = 12345
+
+BYE = -1 # draw slot without a player
+
+DEBUG = True
+
+
+def drawFromTournament(reader, tourID, firstRoundID):
+    '''
+    reader is an AugmentedGamesfileReader that's been loaded.
+    Returns (list<player name>, numpy array of indices into that list, in
+    draw order, BYE for byes). The draw size is a power of 2
+    '''
+    keyCol = reader.col("MatchKey")
+    wNameCol, lNameCol = reader.col("WName"), reader.col("LName")
+    rounds = dict() # round ID -> list<(winnerID, loserID)>
+    names = dict()  # player ID -> name
+    for row in reader.rows():
+        winnerID, loserID, tID, roundID = row[keyCol].split("/")
+        if tID != tourID or int(roundID) < int(firstRoundID):
+            continue
+        rounds.setdefault(int(roundID), list()).append((winnerID, loserID))
+        names[winnerID], names[loserID] = row[wNameCol], row[lNameCol]
+    if not rounds:
+        raise ValueError("No matches for tour %s from round %s" % (
+                                                     tourID, firstRoundID))
+
+    # each player maps to the (list of draw slots of the) section of the
+    # draw they've come through so far; a round's matches merge sections
+    sections = dict()
+    for level, roundID in enumerate(sorted(rounds)):
+        size = 2 ** level # slots per section coming into this round
+        for winnerID, loserID in rounds[roundID]:
+            merged = list()
+            for playerID in (winnerID, loserID):
+                section = sections.get(playerID, [playerID])
+                merged.extend(section + [BYE] * (size - len(section)))
+            for playerID in merged:
+                if playerID != BYE:
+                    sections[playerID] = merged
+
+    # normally there's a single section left, but gaps in the data can
+    # leave several. Keep them in the order their first players turned up
+    draw, seen = list(), set()
+    for roundID in sorted(rounds):
+        for match in rounds[roundID]:
+            section = sections[match[0]]
+            if id(section) not in seen:
+                seen.add(id(section))
+                draw.extend(section)
+    size = 1
+    while size < len(draw):
+        size *= 2
+    draw.extend([BYE] * (size - len(draw)))
+
+    playerIDs = sorted(names)
+    position = dict((playerID, i) for i, playerID in enumerate(playerIDs))
+    return ([names[playerID] for playerID in playerIDs],
+            np.array([position[p] if p != BYE else BYE for p in draw]))
+
+
+class MatchupModel(object):
+    '''
+    Matrix of win probabilities: getMatrix()[i, j] is the probability player
+    i beats player j. Starts off as all coin-tosses, fill it in with
+    setProb() or load() it from a csv
+    '''
+    def __init__(self, players):
+        self._players = players
+        self._position = dict((name, i) for i, name in enumerate(players))
+        self._probs = np.full((len(players), len(players)), 0.5)
+
+    def setProb(self, playerA, playerB, probAWins):
+        a, b = self._position[playerA], self._position[playerB]
+        self._probs[a, b] = probAWins
+        self._probs[b, a] = 1.0 - probAWins
+
+    def load(self, fname):
+        '''
+        Reads PlayerA,PlayerB,ProbAWins rows (with a header). Returns the
+        number of rows about players who aren't in the draw
+        '''
+        unknown = 0
+        with open(fname, "r") as f:
+            rows = csv.reader(f)
+            rows.next() # skips the header
+            for row in rows:
+                if row[0] in self._position and row[1] in self._position:
+                    self.setProb(row[0], row[1], float(row[2]))
+                else:
+                    unknown += 1
+        return unknown
+
+    def getMatrix(self):
+        return self._probs
+
+
+def simulateChunk(args):
+    '''
+    Simulates the draw nSims times. Returns an array of shape
+    (players, rounds + 1): entry [i, r] is the number of simulations in which
+    player i was still in the draw at round r (r = rounds means winning it)
+    '''
+    probs, draw, nSims, seed, chunk = args
+    rng = np.random.RandomState([seed, chunk])
+    nPlayers, nRounds = probs.shape[0], int(np.log2(len(draw)))
+    # byes become an extra player who loses to everyone, then matchups are
+    # looked up by flat index which is a lot quicker than probs[a, b]
+    stride = nPlayers + 1
+    padded = np.zeros((stride, stride))
+    padded[:nPlayers, :nPlayers] = probs
+    padded[:nPlayers, nPlayers] = 1.0
+    padded = padded.ravel()
+    field = np.tile(np.where(draw == BYE, nPlayers, draw).astype(np.int32),
+                    (nSims, 1)) # row per simulation
+    reached = np.zeros((stride, nRounds + 1), dtype=np.int64)
+    reached[:, 0] = np.bincount(field[0], minlength=stride) * nSims
+    for r in xrange(nRounds):
+        a, b = field[:, 0::2], field[:, 1::2]
+        aWins = rng.random_sample(a.shape) < padded.take(a * stride + b)
+        field = np.where(aWins, a, b)
+        reached[:, r + 1] = np.bincount(field.ravel(), minlength=stride)
+    return reached[:nPlayers]
+
+
+def simulateDraw(probs, draw, nSims=DEFAULT_SIMS, seed=DEFAULT_SEED,
+                 processes=None):
+    '''
+    probs as MatchupModel.getMatrix(), draw as drawFromTournament() returns.
+    Returns array (players, rounds + 1) of probabilities of reaching each
+    round, see simulateChunk()
+    '''
+    chunks = list()
+    for chunk in xrange(0, nSims, CHUNK_SIMS):
+        chunks.append((probs, draw, min(CHUNK_SIMS, nSims - chunk), seed,
+                       chunk // CHUNK_SIMS))
+    pool = multiprocessing.Pool(processes)
+    try:
+        reached = sum(pool.map(simulateChunk, chunks))
+    finally:
+        pool.close()
+        pool.join()
+    return reached / float(nSims)
+
+
+def getRoundNames(drawSize):
+    '''
+    e.g. R128, R64, ..., R2 (the final), W (won it)
+    '''
+    names, size = list(), drawSize
+    while size > 1:
+        names.append("R%s" % size)
+        size //= 2
+    names.append("W")
+    return names
+
+
+def doMain():
+    if len(sys.argv) < 4:
+        print ("usage: %s <augmented file> <tourID> <first round ID> "
+               "[matchup probs csv] [simulations] [seed]" % sys.argv[0])
+        return 1
+    augment_games_data.DEBUG = DEBUG
+    reader = AugmentedGamesfileReader(sys.argv[1])
+    reader.load()
+    players, draw = drawFromTournament(reader, sys.argv[2], sys.argv[3])
+    model = MatchupModel(players)
+    if len(sys.argv) > 4 and sys.argv[4]:
+        unknown = model.load(sys.argv[4])
+        if unknown:
+            print "WARNING: %s matchups with players not in the draw" % (
+                                                                   unknown)
+    nSims = int(sys.argv[5]) if len(sys.argv) > 5 else DEFAULT_SIMS
+    seed = int(sys.argv[6]) if len(sys.argv) > 6 else DEFAULT_SEED
+    if DEBUG: print "simulate_draw: %s players in a %s draw, %s sims" % (
+                                              len(players), len(draw), nSims)
+
+    reachProbs = simulateDraw(model.getMatrix(), draw, nSims, seed)
+    writer = csv.writer(sys.stdout, lineterminator="\n")
+    writer.writerow(["Player"] + getRoundNames(len(draw)))
+    for i in np.argsort(-reachProbs[:, -1], kind="mergesort"):
+        writer.writerow([players[i]] + ["%.6f" % p for p in reachProbs[i]])
+    return 0
+
+if __name__ == "__main__":
+   sys.exit(doMain())
@@ -0,0 +1,290 @@
+#!/home/mzc/anaconda2/bin/python
+
+'''
+Program to backtest betting strategies on tennis-data.co.uk files cleaned up
+by cleanup_initial_csv.pl, over whole grids of strategy parameters at once
+
+Notes:
+ - every bookmaker in the files is a pair of <book>W,<book>L odds columns
+   (e.g. B365W,B365L or PSW,PSL), found from the header so files of
+   different years (with different books) can be mixed. The cleanup script
+   lower-cases every header but the ATP one, so book names are matched
+   whatever their case. Missing or unusable odds are nan, and matches
+   without odds from the books a strategy uses are never bet on. Walkovers
+   are skipped altogether, as are the log lines the cleanup script appends
+   to its output
+
+ - a strategy takes its win probabilities from a model book's odds with
+   the margin taken out (1/odds, normalized to add up to 1) and backs
+   whichever player has the bigger edge (prob * odds - 1) at a betting
+   book's odds, as long as that edge is at least minEdge and the odds are
+   no more than maxOdds. It stakes either FLAT_STAKE of the starting
+   bankroll a bet, or a fraction of the Kelly stake (edge / (odds - 1)) of
+   the current bankroll, capped at MAX_STAKE
+
+ - bets are settled in date order, one at a time (we don't know the order
+   of matches within a day). Stakes are a fraction of the bankroll, so the
+   bankroll after each bet is a cumulative sum (flat) or product (Kelly)
+   over the matches: a whole chunk of strategies is simulated with a few
+   numpy operations on (strategies x matches) arrays, no loop over matches
+
+ - the grid (see the defaults below) is split into chunks of
+   CHUNK_STRATEGIES strategies, which are farmed out to a process pool
+
+ - for each strategy we report the number of bets and winners, turnover
+   and profit (in starting bankrolls), ROI (profit / turnover), the worst
+   drawdown from a peak (as a fraction of that peak) and the final
+   bankroll. Flat stakes carry on regardless of the bankroll, so it can go
+   below 0: a MaxDrawdown of 1 means the strategy went bust. Rows are
+   sorted by ROI, strategies that never bet go last
+
+ - usage: backtest_strategies.py <results csv> <cleaned csv> [<cleaned csv>...]
+'''
+
+import csv
+import datetime
+import multiprocessing
+import sys
+
+import numpy as np
+
+MODEL_BOOKS = ("PS",)                   # where win probabilities come from
+BET_BOOKS = ("Max", "B365", "PS")       # whose odds we bet at
+KELLY_FRACTIONS = (0.0, 0.1, 0.25, 0.5, 1.0) # 0 means flat stakes
+MIN_EDGES = (0.0, 0.02, 0.05, 0.1)
+MAX_ODDS = (2.0, 3.0, 5.0, 1000.0)
+
+FLAT_STAKE = 0.01       # of the starting bankroll
+MAX_STAKE = 0.25        # of the current bankroll, for Kelly stakes
+CHUNK_STRATEGIES = 16
+
+DATE_COL = "Date"
+COMMENT_COL = "Comment"
+WALKOVER = "walkover"
+LOG_PREFIXES = ("Name <", "Comment <") # the cleanup script's log lines
+
+RESULT_HEADER = ["ModelBook", "BetBook", "Staking", "KellyFraction",
+                 "MinEdge", "MaxOdds", "Bets", "Won", "Turnover", "Profit",
+                 "ROI", "MaxDrawdown", "FinalBankroll"]
+
+DEBUG = True
+
+
+def dateToOrdinal(dateStr):
+    '''
+    Dates are d/m/y, or y-m-d in some years' files
+    '''
+    if "-" in dateStr:
+        y, m, d = dateStr.split("-")
+    else:
+        d, m, y = dateStr.split("/")
+    return datetime.date(int(y), int(m), int(d)).toordinal()
+
+
+def floatOrNan(s):
+    try:
+        value = float(s)
+    except ValueError:
+        return float("nan")
+    return value if value > 1.0 else float("nan") # odds of 1 or less are junk
+
+
+class MatchOdds(object):
+    '''
+    The matches of one or more cleaned files as typed arrays, in date order:
+     - Create one
+     - Call load() with each file
+     - Call finish()
+     - Call getBook() for a book's (winner odds, loser odds) arrays
+    '''
+    def __init__(self):
+        self._dates = list()
+        # lower-cased book -> (list<winner odds>, list<loser odds>)
+        self._odds = dict()
+        self._nMatches = 0
+        self.dates = None
+
+    def load(self, fname):
+        with open(fname, "r") as f:
+            rows = csv.reader(f)
+            header = [name.strip() for name in rows.next()]
+            position = dict((name.lower(), i) for i, name in enumerate(header))
+            books = dict() # lower-cased book -> (winner col, loser col)
+            for name in position:
+                book = name[:-1]
+                if book and name.endswith("w") and "%sl" % book in position:
+                    books[book] = (position[name], position["%sl" % book])
+            dateCol = position[DATE_COL.lower()]
+            commentCol = position.get(COMMENT_COL.lower())
+
+            nLoaded, nSkipped = 0, 0
+            for row in rows:
+                if not row or row[0].startswith(LOG_PREFIXES):
+                    continue
+                # perl's split drops trailing empty fields
+                row.extend([""] * (len(header) - len(row)))
+                if (commentCol is not None and
+                    row[commentCol].strip().lower() == WALKOVER):
+                    nSkipped += 1
+                    continue
+                try:
+                    date = dateToOrdinal(row[dateCol].strip())
+                except ValueError:
+                    print "WARNING: Skipping row with date %s in %s" % (
+                                                         row[dateCol], fname)
+                    nSkipped += 1
+                    continue
+                self._dates.append(date)
+                for book, (wCol, lCol) in books.iteritems():
+                    if book not in self._odds:
+                        # nan for the matches of files without this book
+                        self._odds[book] = ([float("nan")] * self._nMatches,
+                                            [float("nan")] * self._nMatches)
+                    self._odds[book][0].append(floatOrNan(row[wCol]))
+                    self._odds[book][1].append(floatOrNan(row[lCol]))
+                for book, (wOdds, lOdds) in self._odds.iteritems():
+                    if book not in books:
+                        wOdds.append(float("nan"))
+                        lOdds.append(float("nan"))
+                self._nMatches += 1
+                nLoaded += 1
+        if DEBUG: print "MatchOdds: %s matches (%s skipped) from %s" % (
+                                                    nLoaded, nSkipped, fname)
+
+    def finish(self):
+        order = np.argsort(np.array(self._dates), kind="mergesort")
+        self.dates = np.array(self._dates, dtype=np.int32)[order]
+        self._odds = dict(
+                (book, (np.array(wOdds)[order], np.array(lOdds)[order]))
+                for book, (wOdds, lOdds) in self._odds.iteritems())
+        self._dates = None
+        if DEBUG: print "MatchOdds: %s matches, books %s" % (
+                                    len(self.dates), sorted(self._odds))
+
+    def __len__(self):
+        return len(self.dates)
+
+    def getBooks(self):
+        return sorted(self._odds)
+
+    def getBook(self, book):
+        '''
+        Returns (winner odds, loser odds), all nan if we've no such book
+        '''
+        book = book.lower()
+        if book not in self._odds:
+            missing = np.full(len(self.dates), np.nan)
+            return missing, missing
+        return self._odds[book]
+
+
+def getBets(matchOdds, modelBook, betBook):
+    '''
+    For each match, the bet a strategy would consider: returns arrays
+    (edge, odds, won) for backing whichever player has the bigger edge.
+    edge is -inf where either book is missing odds for either player, or
+    where both players have the same edge (we can't pick a side there
+    without knowing who won)
+    '''
+    mW, mL = matchOdds.getBook(modelBook)
+    bW, bL = matchOdds.getBook(betBook)
+    with np.errstate(invalid="ignore"):
+        probW = (1.0 / mW) / (1.0 / mW + 1.0 / mL)
+        edgeW, edgeL = probW * bW - 1.0, (1.0 - probW) * bL - 1.0
+        backW = edgeW > edgeL
+    edge = np.where(backW, edgeW, edgeL)
+    edge[(edgeW == edgeL) | np.isnan(mW + mL + bW + bL)] = -np.inf
+    won = backW # the W columns are the winner's
+    return edge, np.where(backW, bW, bL), won
+
+
+def backtestChunk(args):
+    '''
+    Simulates a chunk of strategies, given as arrays of kelly fraction (0
+    for flat stakes), minEdge and maxOdds, over the bets from getBets().
+    Returns array of shape (strategies, 7): bets, won, turnover, profit,
+    ROI, max drawdown, final bankroll - see the notes up top
+    '''
+    edge, odds, won, kelly, minEdge, maxOdds = args
+    flat = (kelly == 0)[:, None]
+    with np.errstate(invalid="ignore"):
+        bet = (edge >= minEdge[:, None]) & (odds <= maxOdds[:, None])
+        kellyStake = np.minimum(kelly[:, None] * edge / (odds - 1.0),
+                                MAX_STAKE)
+    stake = np.where(bet, np.where(flat, FLAT_STAKE, kellyStake), 0.0)
+    returns = np.where(won, odds - 1.0, -1.0) # per unit staked
+    returns[~np.isfinite(returns)] = 0.0      # never bet on anyway
+    change = stake * returns
+
+    # bankroll after each bet, starting from 1
+    bankroll = np.where(flat, 1.0 + np.cumsum(change, axis=1),
+                        np.exp(np.cumsum(np.log1p(change), axis=1)))
+    before = np.hstack([np.ones((len(kelly), 1)), bankroll[:, :-1]])
+    turnover = np.where(flat, stake, stake * before).sum(axis=1)
+    peaks = np.maximum.accumulate(before, axis=1)
+    drawdown = np.minimum((peaks - bankroll) / peaks, 1.0).max(axis=1)
+    final = bankroll[:, -1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        roi = np.where(turnover > 0, (final - 1.0) / turnover, np.nan)
+    return np.column_stack([bet.sum(axis=1), (bet & won).sum(axis=1),
+                            turnover, final - 1.0, roi, drawdown, final])
+
+
+def backtestGrid(matchOdds, modelBooks=MODEL_BOOKS, betBooks=BET_BOOKS,
+                 kellyFractions=KELLY_FRACTIONS, minEdges=MIN_EDGES,
+                 maxOdds=MAX_ODDS, processes=None):
+    '''
+    Backtests every combination of the given parameters.
+    Returns list<result row>, see RESULT_HEADER
+    '''
+    grid = np.array([(k, e, o) for k in kellyFractions for e in minEdges
+                               for o in maxOdds], dtype=float)
+    tasks, labels = list(), list()
+    for modelBook in modelBooks:
+        for betBook in betBooks:
+            edge, odds, won = getBets(matchOdds, modelBook, betBook)
+            for start in xrange(0, len(grid), CHUNK_STRATEGIES):
+                chunk = grid[start:start + CHUNK_STRATEGIES]
+                tasks.append((edge, odds, won,
+                              chunk[:, 0], chunk[:, 1], chunk[:, 2]))
+                labels.extend((modelBook, betBook, k, e, o)
+                              for k, e, o in chunk)
+    if DEBUG: print "backtestGrid: %s strategies over %s matches" % (
+                                                 len(labels), len(matchOdds))
+    pool = multiprocessing.Pool(processes)
+    try:
+        metrics = np.vstack(pool.map(backtestChunk, tasks))
+    finally:
+        pool.close()
+        pool.join()
+
+    results = list()
+    for (modelBook, betBook, k, e, o), m in zip(labels, metrics):
+        results.append([modelBook, betBook, "kelly" if k else "flat", k, e, o,
+                        int(m[0]), int(m[1])] + list(m[2:]))
+    results.sort(key=lambda r: -r[10] if r[10] == r[10] else float("inf"))
+    return results
+
+
+def doMain():
+    if len(sys.argv) < 3:
+        print "usage: %s <results csv> <cleaned csv> [<cleaned csv>...]" % (
+                                                                 sys.argv[0])
+        return 1
+    matchOdds = MatchOdds()
+    for fname in sys.argv[2:]:
+        matchOdds.load(fname)
+    matchOdds.finish()
+
+    results = backtestGrid(matchOdds)
+    if DEBUG: print "backtest_strategies: Dumping to %s" % sys.argv[1]
+    with open(sys.argv[1], "wb") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(RESULT_HEADER)
+        for r in results:
+            writer.writerow(r[:3] + ["%g" % v for v in r[3:6]] + r[6:8] +
+                            ["%.4f" % v for v in r[8:]])
+    return 0
+
+if __name__ == "__main__":
+   sys.exit(doMain())